@@ -0,0 +1,231 @@
+# qraft command line, a subcommand per workflow:
+#   python cli.py generate --circuits 200 --output data.csv --workers 4
+#   python cli.py train --data data.csv --model qraft1.pkl
+#   python cli.py evaluate --model qraft.pkl --plots
+#   python cli.py predict --model qraft_forest circuits.json
+#   python cli.py featurize circuits.json --output features.npz
+# Every subcommand imports only the modules it needs, when it runs: predict and featurize of dense circuits
+# never import qiskit, pandas, matplotlib or sklearn (flat forest models), and the model is loaded only once
+# the features are ready. The import, loading and run times are reported on stderr
+import time
+started = time.perf_counter()
+import argparse
+import contextlib
+import json
+import os
+import sys
+
+root = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [os.path.join(root, "data_generation"), os.path.join(root, "qraft")]
+
+
+class Timings:
+    # wall time of the stages of a subcommand, reported with the time since the cli started
+    def __init__(self, command) -> None:
+        self.command = command
+        self.stages = {}
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0) + time.perf_counter() - start
+
+    def report(self):
+        stages = ", ".join(f"{name} {seconds * 1000:.0f}ms" for name, seconds in self.stages.items())
+        print(f"qraft {self.command}: {stages}, total {(time.perf_counter() - started) * 1000:.0f}ms", file=sys.stderr)
+
+
+def read_circuits(file_name):
+    # a circuit or a list of circuits in the format of the correction server, from a json file or stdin (-)
+    with (contextlib.nullcontext(sys.stdin) if file_name == "-" else open(file_name)) as file:
+        circuits = json.load(file)
+    return circuits if isinstance(circuits, list) else [circuits]
+
+def get_features(circuits, timings):
+    # Feature matrix of all the circuits, the rows of circuit i at offsets[i]:offsets[i + 1], and their state names.
+    # Dense circuits are featurized together with numpy only, sparse ones need the state statistics
+    if any(circuit.get("sparse", False) for circuit in circuits):
+        with timings.stage("imports"):
+            import numpy as np
+            from server import get_circuit_features
+        with timings.stage("features"):
+            features, names = zip(*[get_circuit_features(circuit) for circuit in circuits])
+            offsets = np.cumsum([0] + [len(circuit_names) for circuit_names in names])
+            return np.concatenate(features), offsets, list(names)
+
+    with timings.stage("imports"):
+        from features import build_features, get_run_counts
+    with timings.stage("features"):
+        circuit_widths = [int(circuit["circuit_width"]) for circuit in circuits]
+        if not all(1 <= circuit_width <= 20 for circuit_width in circuit_widths):
+            raise ValueError("unsupported circuit width, 20 qubits at most")
+        features, offsets = build_features(
+            circuit_widths,
+            [int(circuit["circuit_depth"]) for circuit in circuits],
+            [circuit.get("gates_count", {}) for circuit in circuits],
+            [get_run_counts(circuit["fc_counts"], circuit_width)[1] for circuit, circuit_width in zip(circuits, circuit_widths)],
+            [get_run_counts(circuit["frc_counts"], circuit_width)[1] for circuit, circuit_width in zip(circuits, circuit_widths)]
+        )
+        names = [[format(state, '0' + str(circuit_width) + 'b') for state in range(1 << circuit_width)] for circuit_width in circuit_widths]
+        return features, offsets, names
+
+
+def predict(args, timings):
+    circuits = read_circuits(args.input)
+    features, offsets, names = get_features(circuits, timings)
+
+    with timings.stage("imports"):
+        from prediction import get_corrected_distribution, load_model
+    with timings.stage("load"):
+        model = load_model(args.model)
+    with timings.stage("predict"):
+        predictions = model.predict(features)
+
+    results = []
+    for i, circuit_names in enumerate(names):
+        circuit_predictions = predictions[offsets[i]:offsets[i + 1]]
+        results.append({
+            "probabilities": get_corrected_distribution(circuit_predictions, circuit_names),
+            "predictions": dict(zip(circuit_names, circuit_predictions.tolist()))
+        })
+    with (open(args.output, "w") if args.output else contextlib.nullcontext(sys.stdout)) as file:
+        json.dump(results, file)
+        file.write("\n")
+
+def featurize(args, timings):
+    circuits = read_circuits(args.input)
+    features, offsets, _ = get_features(circuits, timings)
+    with timings.stage("write"):
+        import numpy as np
+        np.savez(args.output, features=features, offsets=offsets)
+
+def generate(args, timings):
+    with timings.stage("imports"):
+        if args.pipelined:
+            from pipeline import gen_data_pipelined
+        else:
+            from data import gen_data
+        from state import AdaptiveSampling
+
+    with timings.stage("generate"):
+        adaptive = AdaptiveSampling(tolerance=args.adaptive) if args.adaptive else None
+        options = dict(seed=args.seed, dataset_name=args.dataset, cache_dir=args.cache_dir, max_width=args.max_width, sparse=args.sparse, adaptive=adaptive, engine=args.engine)
+        if args.pipelined:
+            gen_data_pipelined(args.output, args.circuits, simulation_workers=args.workers, **options)
+        else:
+            gen_data(args.output, args.circuits, n_workers=args.workers, **options)
+
+def train(args, timings):
+    with timings.stage("imports"):
+        from training import train as train_model
+    with timings.stage("train"):
+        train_model(args.data, args.model, args.forest, n_iter=args.iterations, checkpoint=args.checkpoint)
+
+def evaluate(args, timings):
+    # a results table of the circuits, or with --aggregate only their aggregated metrics, in constant memory.
+    # --merge combines the aggregates saved by the workers evaluating disjoint --start ranges
+    if args.merge:
+        with timings.stage("imports"):
+            from aggregation import MetricsAggregator
+        with timings.stage("merge"):
+            results = MetricsAggregator.load_merged(args.merge)
+            print(json.dumps(results.summary(), indent=2))
+    else:
+        with timings.stage("imports"):
+            from evaluation import evaluate as evaluate_model, evaluate_streaming
+            from prediction import load_model
+            from cache import SimulationCache
+        with timings.stage("load"):
+            model = load_model(args.model)
+        with timings.stage("evaluate"):
+            cache = SimulationCache(args.cache_dir) if args.cache_dir else None
+            if args.aggregate:
+                results = evaluate_streaming(model, args.circuits, args.width, args.depth, cache=cache, start=args.start, batch_size=args.batch_size)
+                results.save(args.aggregate)
+                print(json.dumps(results.summary(), indent=2))
+            else:
+                results = evaluate_model(model, args.circuits, args.width, args.depth, cache=cache, start=args.start)
+                results.to_csv(args.output, index=False)
+                print(results)
+
+    if args.plots:
+        with timings.stage("imports"):
+            from benchmarking_error import render_error_plots
+            from benchmarking_empirical_cdf import render_ecdf_plots
+        with timings.stage("plots"):
+            # the bar charts need the per circuit rows
+            if not (args.merge or args.aggregate):
+                render_error_plots(results.head(10))
+            render_ecdf_plots(results)
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(prog="qraft", description="Qraft data generation, training, evaluation and inference")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    parser_generate = subparsers.add_parser("generate", help="generate training circuits")
+    parser_generate.add_argument("--circuits", type=int, default=200)
+    parser_generate.add_argument("--output", default="data1.csv", help="csv file, empty to write the dataset only")
+    parser_generate.add_argument("--dataset", help="also write a columnar dataset directory")
+    parser_generate.add_argument("--workers", type=int, default=os.cpu_count())
+    parser_generate.add_argument("--seed", type=int)
+    parser_generate.add_argument("--cache-dir")
+    parser_generate.add_argument("--max-width", type=int, default=5)
+    parser_generate.add_argument("--sparse", action="store_true", help="keep only the observed and ideal states")
+    parser_generate.add_argument("--engine", choices=["aer", "numpy"], default="aer")
+    parser_generate.add_argument("--adaptive", type=float, help="adaptive number of runs with this tolerance")
+    parser_generate.add_argument("--pipelined", action="store_true", help="single process pipeline, workers simulate concurrently")
+    parser_generate.set_defaults(function=generate)
+
+    parser_train = subparsers.add_parser("train", help="search the hyperparameters and train the model")
+    parser_train.add_argument("--data", help="csv file or columnar dataset, data or data.csv by default")
+    parser_train.add_argument("--model", default="qraft1.pkl")
+    parser_train.add_argument("--forest", default="qraft1_forest", help="flat arrays export directory, empty to skip it")
+    parser_train.add_argument("--iterations", type=int, default=50)
+    parser_train.add_argument("--checkpoint", default="search_checkpoint.pkl")
+    parser_train.set_defaults(function=train)
+
+    parser_evaluate = subparsers.add_parser("evaluate", help="evaluate the model against the baseline on the benchmark circuits")
+    parser_evaluate.add_argument("--model", default="qraft.pkl", help="pickled model or exported forest directory")
+    parser_evaluate.add_argument("--circuits", type=int, default=25)
+    parser_evaluate.add_argument("--width", type=int, default=3)
+    parser_evaluate.add_argument("--depth", type=int, default=4)
+    parser_evaluate.add_argument("--output", default="evaluation_results.csv")
+    parser_evaluate.add_argument("--cache-dir", default="simulation_cache")
+    parser_evaluate.add_argument("--start", type=int, default=0, help="index of the first circuit")
+    parser_evaluate.add_argument("--aggregate", help="save only the aggregated metrics to this json file")
+    parser_evaluate.add_argument("--batch-size", type=int, default=100, help="circuits evaluated at once with --aggregate")
+    parser_evaluate.add_argument("--merge", nargs="+", help="merge these aggregated metrics files instead of evaluating")
+    parser_evaluate.add_argument("--plots", action="store_true", help="render the error and ecdf plots")
+    parser_evaluate.set_defaults(function=evaluate)
+
+    for name, function, help in [("predict", predict, "correct the measured distributions of circuits"), ("featurize", featurize, "compute the feature matrix of circuits")]:
+        parser_command = subparsers.add_parser(name, help=help)
+        parser_command.add_argument("input", help="json circuit or list of circuits in the server format, - for stdin")
+        if name == "predict":
+            parser_command.add_argument("--model", default="qraft.pkl", help="pickled model or exported forest directory")
+            parser_command.add_argument("--output", help="json file, stdout by default")
+        else:
+            parser_command.add_argument("--output", default="features.npz", help="npz file with the features and offsets arrays")
+        parser_command.set_defaults(function=function)
+
+    return parser
+
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+    timings = Timings(args.command)
+    timings.stages["startup"] = time.perf_counter() - started
+    try:
+        args.function(args, timings)
+    except (ValueError, KeyError) as error:
+        # invalid inputs are reported without a traceback
+        sys.exit(f"qraft {args.command}: {type(error).__name__}: {error}")
+    finally:
+        timings.report()
+
+
+if __name__ == "__main__":
+    main()
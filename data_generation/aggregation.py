@@ -0,0 +1,220 @@
+# constant memory aggregation of the evaluation metrics. Every metric column keeps a quantile sketch and a
+# fixed bins histogram instead of its values, so millions of circuits are evaluated in batches or on many
+# machines and the partial aggregates merged afterwards, e.g.
+#   aggregator = MetricsAggregator(["medians_base", "medians_qraft"])
+#   aggregator.update(results)                       # any table or dict of columns
+#   aggregator.merge(MetricsAggregator.load("worker_1.json"))
+#   aggregator.summary()["medians_qraft"]["p50"]
+# Merges are exact: merging aggregates gives the same aggregate as updating a single one with all the values,
+# up to the float rounding of the sums
+import json
+import numpy as np
+
+
+class QuantileSketch:
+    # Quantiles with relative accuracy over non negative values (DDSketch): a value x is counted in the bucket
+    # ceil(log_gamma(x)), gamma = (1 + a)/(1 - a), and every quantile is returned within a relative error a.
+    # Values up to min_value are counted as zeros. Buckets are few, 100/1e-9 spans ~2500 of them at a = 0.005
+    def __init__(self, relative_accuracy=0.005, min_value=1e-9) -> None:
+        if not 0 < relative_accuracy < 1:
+            raise ValueError("the relative accuracy must be in (0, 1)")
+        self.relative_accuracy = relative_accuracy
+        self.min_value = min_value
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = np.log(self.gamma)
+        self.buckets = {}
+        self.zero_count = 0
+        self.count = 0
+
+    def update(self, values):
+        values = np.asarray(values, dtype=float).ravel()
+        if np.any(np.isnan(values)) or np.any(values < 0):
+            raise ValueError("the quantile sketch needs non negative values")
+        zeros = values <= self.min_value
+        self.zero_count += int(zeros.sum())
+        self.count += len(values)
+
+        keys, counts = np.unique(np.ceil(np.log(values[~zeros]) / self.log_gamma).astype(np.int64), return_counts=True)
+        for key, count in zip(keys.tolist(), counts.tolist()):
+            self.buckets[key] = self.buckets.get(key, 0) + count
+
+    def merge(self, other):
+        if (self.relative_accuracy, self.min_value) != (other.relative_accuracy, other.min_value):
+            raise ValueError("only sketches with the same relative accuracy and min value can be merged")
+        for key, count in other.buckets.items():
+            self.buckets[key] = self.buckets.get(key, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+        return self
+
+    def get_value(self, rank):
+        # estimate of the value of integer rank, the center of the bucket holding it
+        cumulative = self.zero_count
+        if cumulative > rank:
+            return 0.0
+        for key in sorted(self.buckets):
+            cumulative += self.buckets[key]
+            if cumulative > rank:
+                break
+        return float(2 * self.gamma**key / (self.gamma + 1))
+
+    def quantile(self, q):
+        # linearly interpolated between the two closest ranks as np.percentile, so the 0.5 quantile of an even
+        # number of values is the mean of the middle ones as statistics.median
+        if not self.count:
+            return float("nan")
+        rank = q * (self.count - 1)
+        lower, upper = self.get_value(int(np.floor(rank))), self.get_value(int(np.ceil(rank)))
+        return lower + (rank - np.floor(rank)) * (upper - lower)
+
+    def to_dict(self):
+        return {
+            "relative_accuracy": self.relative_accuracy, "min_value": self.min_value, "zero_count": self.zero_count,
+            "count": self.count, "buckets": {str(key): count for key, count in self.buckets.items()}
+        }
+
+    @classmethod
+    def from_dict(cls, content):
+        sketch = cls(content["relative_accuracy"], content["min_value"])
+        sketch.buckets = {int(key): count for key, count in content["buckets"].items()}
+        sketch.zero_count = content["zero_count"]
+        sketch.count = content["count"]
+        return sketch
+
+
+class HistogramECDF:
+    # Empirical cdf over n_bins equal bins in [low, high] with an underflow and an overflow bin. The cdf is exact
+    # at the bin edges, in between it is off by at most the fraction of values in the bin. Min, max, count and
+    # sum are kept exactly
+    def __init__(self, low=0, high=100, n_bins=10000) -> None:
+        self.low = low
+        self.high = high
+        self.n_bins = n_bins
+        self.counts = np.zeros(n_bins + 2, dtype=np.int64)
+        self.total = 0.0
+        self.min = float("inf")
+        self.max = float("-inf")
+
+    @property
+    def count(self):
+        return int(self.counts.sum())
+
+    @property
+    def edges(self):
+        return np.linspace(self.low, self.high, self.n_bins + 1)
+
+    def update(self, values):
+        values = np.asarray(values, dtype=float).ravel()
+        if not len(values):
+            return
+        if np.any(np.isnan(values)):
+            raise ValueError("the histogram needs numeric values")
+        # bin i + 1 holds [edge i, edge i + 1), high is in the last bin
+        bins = np.floor((values - self.low) / (self.high - self.low) * self.n_bins).astype(np.int64) + 1
+        bins[values == self.high] = self.n_bins
+        self.counts += np.bincount(np.clip(bins, 0, self.n_bins + 1), minlength=self.n_bins + 2)
+        self.total += float(values.sum())
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+
+    def merge(self, other):
+        if (self.low, self.high, self.n_bins) != (other.low, other.high, other.n_bins):
+            raise ValueError("only histograms with the same bins can be merged")
+        self.counts += other.counts
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    def get_ecdf(self):
+        # Points (x, F(x)) of the cdf at the upper edge of every non empty bin, the underflow and overflow bins
+        # at the min and max values
+        upper_edges = np.minimum(np.concatenate([[self.min], self.edges[1:], [self.max]]), self.max)
+        non_empty = self.counts > 0
+        return upper_edges[non_empty], np.cumsum(self.counts)[non_empty] / max(self.count, 1)
+
+    def to_dict(self):
+        return {
+            "low": self.low, "high": self.high, "n_bins": self.n_bins, "total": self.total, "min": self.min, "max": self.max,
+            # sparse counts, most bins are empty
+            "counts": {str(i): count for i, count in zip(np.flatnonzero(self.counts).tolist(), self.counts[self.counts > 0].tolist())}
+        }
+
+    @classmethod
+    def from_dict(cls, content):
+        histogram = cls(content["low"], content["high"], content["n_bins"])
+        for i, count in content["counts"].items():
+            histogram.counts[int(i)] = count
+        histogram.total, histogram.min, histogram.max = content["total"], content["min"], content["max"]
+        return histogram
+
+
+class MetricsAggregator:
+    # Quantile sketch and histogram cdf of every metric column. Metrics are errors in %, in [low, high]
+    quantiles = [25, 50, 75]
+
+    def __init__(self, columns, relative_accuracy=0.005, low=0, high=100, n_bins=10000) -> None:
+        self.columns = list(columns)
+        self.sketches = {column: QuantileSketch(relative_accuracy) for column in self.columns}
+        self.histograms = {column: HistogramECDF(low, high, n_bins) for column in self.columns}
+
+    def update(self, results):
+        # results maps every column to its values, as a DataFrame or a dict of arrays
+        for column in self.columns:
+            self.sketches[column].update(results[column])
+            self.histograms[column].update(results[column])
+
+    def merge(self, other):
+        if self.columns != other.columns:
+            raise ValueError("only aggregates of the same columns can be merged")
+        for column in self.columns:
+            self.sketches[column].merge(other.sketches[column])
+            self.histograms[column].merge(other.histograms[column])
+        return self
+
+    def get_ecdf(self, column):
+        return self.histograms[column].get_ecdf()
+
+    def summary(self):
+        # count, mean, min, max and quartiles of every column, the quartiles within the sketch relative accuracy
+        summary = {}
+        for column in self.columns:
+            histogram, sketch = self.histograms[column], self.sketches[column]
+            summary[column] = dict(
+                {"count": histogram.count, "mean": histogram.total / histogram.count if histogram.count else float("nan"),
+                 "min": histogram.min, "max": histogram.max},
+                **{f"p{quantile}": sketch.quantile(quantile / 100) for quantile in self.quantiles}
+            )
+        return summary
+
+    def to_dict(self):
+        return {
+            "columns": self.columns,
+            "sketches": {column: sketch.to_dict() for column, sketch in self.sketches.items()},
+            "histograms": {column: histogram.to_dict() for column, histogram in self.histograms.items()}
+        }
+
+    @classmethod
+    def from_dict(cls, content):
+        aggregator = cls([])
+        aggregator.columns = content["columns"]
+        aggregator.sketches = {column: QuantileSketch.from_dict(sketch) for column, sketch in content["sketches"].items()}
+        aggregator.histograms = {column: HistogramECDF.from_dict(histogram) for column, histogram in content["histograms"].items()}
+        return aggregator
+
+    def save(self, file_name):
+        with open(file_name, "w") as file:
+            json.dump(self.to_dict(), file)
+
+    @classmethod
+    def load(cls, file_name):
+        with open(file_name) as file:
+            return cls.from_dict(json.load(file))
+
+    @classmethod
+    def load_merged(cls, file_names):
+        # merges the aggregates saved by the workers
+        aggregator = cls.load(file_names[0])
+        for file_name in file_names[1:]:
+            aggregator.merge(cls.load(file_name))
+        return aggregator
@@ -1,16 +1,12 @@
 # errors evaluation and graph on random circuits
 
-import statistics
 import numpy as np  
-from qiskit.providers.fake_provider import Fake5QV1
-from circuit import CircuitGenerator
-from state import generate_circuit_state
-import joblib
 import matplotlib.pyplot as plt 
 import os
+import sys
+from evaluation import get_results
 
 output_dir = "error_plots" 
-os.makedirs(output_dir, exist_ok=True) 
 
 def plot(x_lab, y_lab, x, y_baseline, y_qraft, name):
   fig = plt.subplots(figsize =(12, 8)) 
@@ -30,97 +26,18 @@ def plot(x_lab, y_lab, x, y_baseline, y_qraft, name):
   filepath = os.path.join(output_dir, filename) 
   plt.savefig(filepath) 
 #   plt.show()
+  plt.close()
 
 
-qraft = joblib.load("qraft.pkl")
+def render_error_plots(results):
+  # bar charts of the base and qraft errors of every circuit in the results table
+  os.makedirs(output_dir, exist_ok=True) 
 
-backend = Fake5QV1()
-circuit_generator = CircuitGenerator()
+  plot(x_lab="Algorithms", y_lab="State Error %", x=results["names"], y_baseline=results["medians_base"], y_qraft=results["medians_qraft"], name = "states")
+  plot(x_lab="Algorithms", y_lab="Dominant State Error %", x=results["names"], y_baseline=results["dse_base"], y_qraft=results["dse_qraft"], name = "program")
+  plot(x_lab="Algorithms", y_lab="Program Error %",x=results["names"], y_baseline=results["program_error_base"], y_qraft=results["program_error_qraft"], name = "dominant_states")
 
-stats_data= {
-  "names": [],
-  "medians": {
-    "base": [],
-    "qraft": []
-  },
-
-  "dse": {
-    "base": [],
-    "qraft": []
-  },
-
-  "program_error": {
-    "base": [],
-    "qraft": []
-  }
-}
-
-for circuit_name in range(10):
-  circuit_width = 3
-  circuit_depth = 4
-  gates = circuit_generator.get_applicable_gates(num_qubits=circuit_width,depth=circuit_depth)
-  fc_circuit = circuit_generator.get_fc_circuit(circuit_width, gates)
-  frc_circuit = circuit_generator.get_frc_circuit(circuit_width, gates)
-  states, extras = generate_circuit_state(fc_circuit, frc_circuit, circuit_width, circuit_depth, backend)
-
-  dominant_state = extras["dominant_state"]
-
-  testing_data = {}
-  for state in states:
-    name = state.pop()
-    result = state.pop()
-    testing_data[name] = {
-      "result": result,
-      "data": state
-    }
-
-  print(testing_data)
-
-  qraft_extra = {
-    "states_errors": {},
-    "program_error": 0,
-    "dominant_state_error": 0
-  }
-
-  for state in testing_data:
-    input = np.array(testing_data[state]["data"])
-    input = input.reshape(1, -1)
-
-    y_pred = qraft.predict(input)
-    y_pred = y_pred[0]
-    qraft_extra["states_errors"][state] = abs(y_pred - testing_data[state]["result"]) /100
-    if state == dominant_state:
-      qraft_extra["dominant_state_error"] = qraft_extra["states_errors"][state]
-    qraft_extra["program_error"] += qraft_extra["states_errors"][state]  
-
-    print(f"Predicted:{y_pred} . Actual:{testing_data[state]["result"]}")
-
-  qraft_extra["program_error"] = qraft_extra["program_error"] / 2
-
-  medians = (
-    statistics.median([error * 100 for error in extras["states_errors"].values()]),
-    statistics.median([error * 100 for error in qraft_extra["states_errors"].values()])
-  )
-  dse = (
-    extras["dominant_state_error"] * 100,
-    qraft_extra["dominant_state_error"] * 100,
-  )
-  pe = (
-    extras["program_error"] * 100,
-    qraft_extra["program_error"] * 100
-  )
-  stats_data["names"].append(f"Circuit {circuit_name}")
-  stats_data["medians"]["base"].append(medians[0])
-  stats_data["medians"]["qraft"].append(medians[1])
-  stats_data["dse"]["base"].append(dse[0])
-  stats_data["dse"]["qraft"].append(dse[1])
-  stats_data["program_error"]["base"].append(pe[0])
-  stats_data["program_error"]["qraft"].append(pe[1])
-
-
-plot(x_lab="Algorithms", y_lab="State Error %", x=stats_data["names"], y_baseline=stats_data["medians"]["base"], y_qraft=stats_data["medians"]["qraft"], name = "states")
-plot(x_lab="Algorithms", y_lab="Dominant State Error %", x=stats_data["names"], y_baseline=stats_data["dse"]["base"], y_qraft=stats_data["dse"]["qraft"], name = "program")
-plot(x_lab="Algorithms", y_lab="Program Error %",x=stats_data["names"], y_baseline=stats_data["program_error"]["base"], y_qraft=stats_data["program_error"]["qraft"], name = "dominant_states")
-
-# empirical cdf of the state error evalutation and plots 
 
+if __name__ == "__main__":
+  # the first 10 circuits of the shared evaluation
+  render_error_plots(get_results(sys.argv[1] if len(sys.argv) > 1 else "qraft.pkl").head(10))
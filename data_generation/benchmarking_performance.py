@@ -0,0 +1,175 @@
+# throughput and latency benchmark of the simulation -> features -> predict pipeline.
+# Every stage is timed separately and the results are written as json to compare commits, e.g.
+# python data_generation/benchmarking_performance.py --widths 1 3 5 8 10 --output perf.json
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from qiskit.providers.fake_provider import Fake5QV1, Fake20QV1
+from circuit import CircuitGenerator, CircuitSimulator, StatevectorSimulator
+from state import StateStatistics
+from prediction import load_model, predict_circuits
+
+try:
+    import resource
+except ImportError:
+    # windows, the resident set size is not reported
+    resource = None
+
+stages = ["gate_generation", "transpilation", "noisy_simulation", "statistics", "feature_building", "prediction"]
+
+
+def get_backend(circuit_width):
+    # the 5 qubits backend used by the training data, a 20 qubits one for the wider circuits
+    return Fake5QV1() if circuit_width <= 5 else Fake20QV1()
+
+def get_max_rss():
+    # peak resident set size of the process in bytes, including the native allocations of aer and numpy that
+    # tracemalloc does not see. ru_maxrss is in kilobytes on linux and in bytes on macos
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+def measure(stage_results, stage, function, *args):
+    # Runs function, accumulating in stage_results its time, the growth of the process peak rss and, when
+    # tracemalloc is tracing, its python heap peak. The peak rss never decreases, a stage only adds the memory
+    # it needs beyond the peak of all the previous stages and configurations
+    tracing = tracemalloc.is_tracing()
+    if tracing:
+        tracemalloc.reset_peak()
+        start_memory = tracemalloc.get_traced_memory()[0]
+    start_max_rss = get_max_rss()
+
+    start = time.perf_counter()
+    result = function(*args)
+    stage_results[stage]["seconds"] += time.perf_counter() - start
+
+    if start_max_rss is not None:
+        stage_results[stage]["max_rss_growth_bytes"] += get_max_rss() - start_max_rss
+    if tracing:
+        stage_results[stage]["python_peak_bytes"] = max(stage_results[stage]["python_peak_bytes"], tracemalloc.get_traced_memory()[1] - start_memory)
+    return result
+
+def benchmark(model, circuit_width, circuit_depth, shots, n_sim, n_circuits, seed=0):
+    # runs n_circuits circuits through every stage of the pipeline
+    backend = get_backend(circuit_width)
+    circuit_generator = CircuitGenerator()
+    stage_results = {stage: {"seconds": 0.0, "python_peak_bytes": 0, "max_rss_growth_bytes": 0 if resource else None} for stage in stages}
+
+    circuits_columns = []
+    dominant_states = []
+    for i in range(n_circuits):
+        def generate_gates():
+            gates = circuit_generator.get_applicable_gates(num_qubits=circuit_width, depth=circuit_depth, seed=seed + i)
+            fc_circuit = circuit_generator.get_compact_fc_circuit(circuit_width, gates)
+            return fc_circuit, fc_circuit.get_frc()
+        fc_circuit, frc_circuit = measure(stage_results, "gate_generation", generate_gates)
+
+        def transpile_circuits():
+            simulators = [CircuitSimulator(fc_circuit, seed=seed + i), CircuitSimulator(frc_circuit, seed=seed + i + 1)]
+            for simulator in simulators:
+                simulator.n_sim = shots
+                simulator.compile(backend)
+            return simulators
+        simulators = measure(stage_results, "transpilation", transpile_circuits)
+
+        def simulate():
+            return [simulator.simulate_counts(backend, n_sim) for simulator in simulators]
+        fc_counts, frc_counts = measure(stage_results, "noisy_simulation", simulate)
+
+        def compute_statistics():
+            ideal_probablities = StatevectorSimulator(circuit_width).simulate(fc_circuit.to_gates())
+            return StateStatistics(circuit_width, ideal_probablities, fc_counts/shots, frc_counts/shots)
+        statistics = measure(stage_results, "statistics", compute_statistics)
+
+        def build_features():
+            return statistics.get_columns(circuit_depth, fc_circuit.count_ops()), statistics.get_extras()
+        columns, extras = measure(stage_results, "feature_building", build_features)
+        circuits_columns.append(columns)
+        dominant_states.append(extras["dominant_state"])
+
+    # all the circuits are predicted in a single batch
+    measure(stage_results, "prediction", predict_circuits, model, circuits_columns, dominant_states)
+
+    for stage in stages:
+        seconds = stage_results[stage]["seconds"]
+        stage_results[stage]["circuits_per_second"] = n_circuits / seconds if seconds else None
+    total_seconds = sum(stage_results[stage]["seconds"] for stage in stages)
+
+    return {
+        "circuit_width": circuit_width,
+        "circuit_depth": circuit_depth,
+        "shots": shots,
+        "n_sim": n_sim,
+        "n_circuits": n_circuits,
+        "backend": backend.name(),
+        "stages": stage_results,
+        "total": {
+            "seconds": total_seconds,
+            "python_peak_bytes": max(stage_results[stage]["python_peak_bytes"] for stage in stages),
+            "max_rss_bytes": get_max_rss(),
+            "circuits_per_second": n_circuits / total_seconds
+        }
+    }
+
+def get_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per stage timing, peak memory and throughput of the Qraft pipeline")
+    parser.add_argument("--widths", type=int, nargs="+", default=list(range(1, 11)))
+    parser.add_argument("--depths", type=int, nargs="+", default=[1, 5, 10, 20])
+    parser.add_argument("--shots", type=int, nargs="+", default=[100, 1000])
+    parser.add_argument("--n-sims", type=int, nargs="+", default=[20, 100])
+    parser.add_argument("--n-circuits", type=int, default=5)
+    parser.add_argument("--no-memory", action="store_true", help="skip the python heap peak pass")
+    parser.add_argument("--output", default="performance.json")
+    args = parser.parse_args()
+
+    # every parameter is swept on its own, the others being kept at the training data defaults
+    baseline = {"circuit_width": 3, "circuit_depth": 4, "shots": CircuitSimulator.n_sim, "n_sim": 100}
+    configurations = (
+        [dict(baseline, circuit_width=width) for width in args.widths] +
+        [dict(baseline, circuit_depth=depth) for depth in args.depths] +
+        [dict(baseline, shots=shots) for shots in args.shots] +
+        [dict(baseline, n_sim=n_sim) for n_sim in args.n_sims]
+    )
+
+    # the flat arrays forest when exported, the pickled sklearn model otherwise
+    model = load_model("qraft_forest" if os.path.isdir("qraft_forest") else "qraft.pkl")
+    results = []
+    for configuration in configurations:
+        result = benchmark(model, n_circuits=args.n_circuits, **configuration)
+
+        # tracemalloc slows down the python allocations, the python heap peak is measured in a second untimed
+        # pass. It misses the native buffers of aer and numpy, the rss of the first pass covers them
+        if not args.no_memory:
+            tracemalloc.start()
+            memory_result = benchmark(model, n_circuits=args.n_circuits, **configuration)
+            tracemalloc.stop()
+            for stage in stages:
+                result["stages"][stage]["python_peak_bytes"] = memory_result["stages"][stage]["python_peak_bytes"]
+            result["total"]["python_peak_bytes"] = memory_result["total"]["python_peak_bytes"]
+
+        results.append(result)
+        print(f"{configuration}: {result['total']['circuits_per_second']:.2f} circuits/s")
+
+    with open(args.output, mode="w") as output_file:
+        json.dump({
+            "commit": get_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpu_count": os.cpu_count(),
+            "results": results
+        }, output_file, indent=2)
+    print(f"Performance results saved to: {args.output}")
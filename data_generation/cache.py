@@ -0,0 +1,108 @@
+# persistent cache of the simulation results, keyed by the content of the circuit and of the backend
+import hashlib
+import json
+import os
+import numpy as np
+from circuit import get_backend_name
+import instrumentation
+
+
+class SimulationCache:
+    # Stores the ideal probabilities and the FC/FRC count matrices (with the observed states of the sparse
+    # simulations) of every simulated circuit in an .npz file named after the hash of the simulation inputs. The least recently used files are
+    # evicted when the directory grows over max_bytes
+    def __init__(self, directory, max_bytes=1 << 30) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+        self.size = sum(entry.stat().st_size for entry in os.scandir(directory) if entry.name.endswith(".npz"))
+
+    @staticmethod
+    def get_backend_key(backend):
+        # name, version and calibration properties of the backend
+        properties = backend.properties() if hasattr(backend, "properties") else None
+        return {
+            "name": get_backend_name(backend),
+            "version": getattr(backend, "backend_version", None) or backend.configuration().backend_version,
+            "properties": properties.to_dict() if properties is not None else None
+        }
+
+    def get_key(self, circuit_width, fc_gates, backend, shots, n_sim, seed=None, exact_ideal=True, sparse=False, adaptive=None):
+        # Canonical hash of the simulation inputs, fc_gates having integer qubit indices. The FRC circuit is always
+        # the forward-reverse of the FC one, so the FC gates identify both. Angles are hashed with their exact float.hex value
+        gates = [
+            [op.__name__, [float(angle).hex() for angle in angles], [int(qubit) for qubit in qubits]]
+            for op, angles, qubits in fc_gates
+        ]
+        content = {
+            "width": circuit_width,
+            "gates": gates,
+            "backend": self.get_backend_key(backend),
+            "shots": shots,
+            "n_sim": n_sim,
+            "seed": seed,
+            "exact_ideal": exact_ideal
+        }
+        # the dense entries keep their keys
+        if sparse:
+            content["sparse"] = True
+        if adaptive:
+            content["adaptive"] = adaptive
+        return hashlib.sha256(json.dumps(content, sort_keys=True, default=str).encode()).hexdigest()
+
+    def get_path(self, key):
+        return os.path.join(self.directory, key + ".npz")
+
+    def get(self, key):
+        # Returns the stored arrays by name, ideal_probablities, fc_counts, frc_counts and the observed
+        # fc_states and frc_states of the sparse entries, or None if the circuit was never simulated
+        path = self.get_path(key)
+        try:
+            with np.load(path) as results:
+                entry = {name: results[name] for name in results.files}
+            # the modification time orders the entries for the eviction
+            os.utime(path)
+        except (FileNotFoundError, OSError, KeyError, ValueError):
+            self.misses += 1
+            instrumentation.count("simulation_cache.miss")
+            return None
+
+        self.hits += 1
+        instrumentation.count("simulation_cache.hit")
+        return entry
+
+    def put(self, key, **arrays):
+        # written to a temporary file first, so concurrent workers never read a partial entry
+        path = self.get_path(key)
+        temporary_path = path + "." + str(os.getpid()) + ".tmp"
+        arrays = {name: array.astype(np.uint32) if name.endswith("_counts") else array for name, array in arrays.items()}
+        with open(temporary_path, mode="wb") as cache_file:
+            np.savez_compressed(cache_file, **arrays)
+        self.size += os.path.getsize(temporary_path)
+        os.replace(temporary_path, path)
+
+        if self.size > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        # removes the least recently used entries until the cache is back to 90% of max_bytes
+        entries = sorted((entry.stat().st_mtime, entry.stat().st_size, entry.path) for entry in os.scandir(self.directory) if entry.name.endswith(".npz"))
+        self.size = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if self.size <= 0.9 * self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                # already evicted by another worker
+                pass
+            self.size -= size
+
+    def cache_info(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": self.size
+        }
@@ -4,6 +4,79 @@ from qiskit.circuit.exceptions import CircuitError
 from qiskit.circuit.library.standard_gates import IGate, U1Gate, U2Gate, U3Gate, XGate, YGate, ZGate, HGate, SGate, SdgGate, TGate, TdgGate, RXGate, RYGate, RZGate, CXGate, CYGate, CZGate, CHGate, CRZGate, CU1Gate, CU3Gate, SwapGate, RZZGate, CCXGate
 from qiskit import transpile
 from qiskit_aer import Aer
+import instrumentation
+
+
+class CompactCircuit:
+    # Array-backed U1/U2/U3/CX circuit: one gate code, up to two qubit indices and up to three angles
+    # per gate (unused slots are -1 / nan). Lowered to a QuantumCircuit only when it gets executed
+    gate_types = [U1Gate, U2Gate, U3Gate, CXGate]
+    gate_names = ["u1", "u2", "u3", "cx"]
+
+    def __init__(self, circuit_width, codes, qubits, angles) -> None:
+        self.circuit_width = circuit_width
+        self.num_qubits = circuit_width
+        self.codes = codes
+        self.qubits = qubits
+        self.angles = angles
+
+    @classmethod
+    def from_gates(cls, circuit_width, applicable_gates):
+        # Builds the arrays from the get_applicable_gates list
+        qr = QuantumRegister(circuit_width, 'q')
+        codes = np.empty(len(applicable_gates), dtype=np.int8)
+        qubits = np.full((len(applicable_gates), 2), -1, dtype=np.int32)
+        angles = np.full((len(applicable_gates), 3), np.nan)
+
+        for i, (op, gate_angles, register_operands) in enumerate(applicable_gates):
+            codes[i] = cls.gate_types.index(op)
+            qubits[i, :len(register_operands)] = [operand if isinstance(operand, (int, np.integer)) else qr.index(operand) for operand in register_operands]
+            angles[i, :len(gate_angles)] = gate_angles
+
+        return cls(circuit_width, codes, qubits, angles)
+
+    def inverse(self):
+        # Reversed gate order with every gate inverted, using the qiskit inverse definitions:
+        # U1(l) -> U1(-l), U2(p, l) -> U2(-l - pi, -p + pi), U3(t, p, l) -> U3(-t, -l, -p), CX -> CX
+        codes = self.codes[::-1].copy()
+        qubits = self.qubits[::-1].copy()
+        angles = self.angles[::-1].copy()
+
+        u1, u2, u3 = codes == 0, codes == 1, codes == 2
+        angles[u1, 0] = -angles[u1, 0]
+        angles[u2, :2] = np.stack([-angles[u2, 1] - np.pi, -angles[u2, 0] + np.pi], axis=1)
+        angles[u3] = np.stack([-angles[u3, 0], -angles[u3, 2], -angles[u3, 1]], axis=1)
+
+        return CompactCircuit(self.circuit_width, codes, qubits, angles)
+
+    def get_frc(self):
+        # forward circuit followed by its inverse
+        inverse = self.inverse()
+        return CompactCircuit(
+            self.circuit_width,
+            np.concatenate([self.codes, inverse.codes]),
+            np.concatenate([self.qubits, inverse.qubits]),
+            np.concatenate([self.angles, inverse.angles])
+        )
+
+    def count_ops(self):
+        # same counts QuantumCircuit.count_ops returns for the gates in the circuit
+        counts = np.bincount(self.codes, minlength=len(self.gate_names))
+        return {name: int(count) for name, count in zip(self.gate_names, counts) if count}
+
+    def to_gates(self):
+        # get_applicable_gates list with integer qubit indices
+        n_angles = [1, 2, 3, 0]
+        return [
+            (self.gate_types[code], angles[:n_angles[code]].tolist(), qubits[qubits >= 0].tolist())
+            for code, qubits, angles in zip(self.codes, self.qubits, self.angles)
+        ]
+
+    def to_qiskit(self):
+        qc = QuantumCircuit(self.circuit_width)
+        for op, angles, operands in self.to_gates():
+            qc.append(op(*angles), operands)
+        return qc
 
 
 class CircuitGenerator:
@@ -79,15 +152,15 @@ class CircuitGenerator:
 
 
     def get_frc_circuit(self, circuit_width, applicable_gates:list):
-        # Return the frc applying the randomly selected gates
-        
-        frc_circuit = self.get_fc_circuit(circuit_width=circuit_width, applicable_gates=applicable_gates)
+        # Return the frc applying the randomly selected gates followed by their inverse, built on the
+        # compact arrays so that the qiskit circuit is constructed only once
+        return self.get_compact_frc_circuit(circuit_width, applicable_gates).to_qiskit()
 
-        # Then reverse the circuit and append the reversed circuit to the forward one
-        rc_circuit = frc_circuit.inverse()
-        frc_circuit.append(rc_circuit, range(0, frc_circuit.num_qubits))
+    def get_compact_fc_circuit(self, circuit_width, applicable_gates):
+        return CompactCircuit.from_gates(circuit_width, applicable_gates)
 
-        return frc_circuit
+    def get_compact_frc_circuit(self, circuit_width, applicable_gates):
+        return CompactCircuit.from_gates(circuit_width, applicable_gates).get_frc()
 
     def apply_gate(self, qc: QuantumCircuit, gate):
         # Applies the gate op to the input circuit
@@ -98,21 +171,184 @@ class CircuitGenerator:
         qc.append(op(*angles), register_operands)
     
 
+class StatevectorSimulator:
+    # Exact NumPy simulator for the U1/U2/U3/CX circuits produced by CircuitGenerator
+    def __init__(self, circuit_width) -> None:
+        self.circuit_width = circuit_width
+        # same register get_applicable_gates samples the operands from
+        self.qr = QuantumRegister(circuit_width, 'q')
+
+    def get_gate_matrix(self, op, angles):
+        # Returns the unitary of a one qubit gate, using the qiskit definitions
+        if op is U1Gate:
+            return np.array([[1, 0], [0, np.exp(1j * angles[0])]])
+
+        if op is U2Gate:
+            theta, phi, lam = np.pi / 2, angles[0], angles[1]
+        elif op is U3Gate:
+            theta, phi, lam = angles
+        else:
+            raise CircuitError(f"{op.__name__} is not supported by the statevector simulator")
+
+        cos, sin = np.cos(theta / 2), np.sin(theta / 2)
+        return np.array([
+            [cos, -np.exp(1j * lam) * sin],
+            [np.exp(1j * phi) * sin, np.exp(1j * (phi + lam)) * cos]
+        ])
+
+    def get_axis(self, operand):
+        # qubit k is bit k of the state index, i.e. axis (width - 1 - k) of the reshaped statevector
+        index = operand if isinstance(operand, (int, np.integer)) else self.qr.index(operand)
+        return self.circuit_width - 1 - index
+
+    def simulate(self, applicable_gates):
+        # Returns the exact probability of every state, indexed by the integer value of the state name
+        return self.simulate_batch([applicable_gates])[0]
+
+    def simulate_batch(self, applicable_gates_list):
+        # Returns a (n_circuits x 2^width) matrix with the exact probabilities of every circuit
+        probabilities = np.empty((len(applicable_gates_list), 1 << self.circuit_width))
+
+        for i, applicable_gates in enumerate(applicable_gates_list):
+            statevector = np.zeros((2,) * self.circuit_width, dtype=complex)
+            statevector[(0,) * self.circuit_width] = 1
+
+            for op, angles, register_operands in applicable_gates:
+                axes = [self.get_axis(operand) for operand in register_operands]
+
+                if op is CXGate:
+                    # flip the target of the states where the control is 1
+                    control = [slice(None)] * self.circuit_width
+                    control[axes[0]] = 1
+                    target_axis = axes[1] - (axes[1] > axes[0])
+                    statevector[tuple(control)] = np.flip(statevector[tuple(control)], axis=target_axis)
+                else:
+                    matrix = self.get_gate_matrix(op, angles)
+                    statevector = np.moveaxis(np.tensordot(matrix, statevector, axes=([1], axes)), 0, axes[0])
+
+            probabilities[i] = np.abs(statevector.ravel()) ** 2
+
+        return probabilities
+
+    @staticmethod
+    def get_circuit_gates(circuit):
+        # Converts the unitary instructions of a QuantumCircuit to the get_applicable_gates format
+        gate_types = {"u1": U1Gate, "u2": U2Gate, "u3": U3Gate, "cx": CXGate}
+        return [
+            (gate_types[instruction.operation.name], [float(angle) for angle in instruction.operation.params], [circuit.find_bit(qubit).index for qubit in instruction.qubits])
+            for instruction in circuit.data if instruction.operation.name not in ("measure", "barrier")
+        ]
+
+
+def get_backend_name(backend):
+    # BackendV1 exposes name() as a method, BackendV2 as an attribute
+    return backend.name() if callable(backend.name) else backend.name
+
+
 class CircuitSimulator:
     n_sim = 100
-    def __init__(self, circuit) -> None:
-        self.circuit = circuit
+    def __init__(self, circuit, seed=None) -> None:
+        # compact circuits are lowered to qiskit here, right before the execution
+        self.circuit = circuit.to_qiskit() if isinstance(circuit, CompactCircuit) else circuit
         self.circuit.measure_active()
 
+        # seeds both the transpiler and the simulator, making the runs reproducible
+        self.seed = seed
+
+        # transpiled circuits, one per backend, reused by every later run
+        self.compiled_circuits = {}
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def compile(self, backend):
+        # Returns the circuit transpiled for the backend, transpiling only on the first request.
+        # Wrappers simulating a device, as NumpyNoisyBackend, are transpiled for the wrapped device
+        device = getattr(backend, "device", backend)
+        backend_name = get_backend_name(device)
+        if backend_name in self.compiled_circuits:
+            self.cache_hits += 1
+            instrumentation.count("transpile_cache.hit")
+        else:
+            self.cache_misses += 1
+            instrumentation.count("transpile_cache.miss")
+            with instrumentation.span("simulate.transpile"):
+                self.compiled_circuits[backend_name] = transpile(self.circuit, device, seed_transpiler=self.seed)
+
+        return self.compiled_circuits[backend_name]
+
+    def cache_info(self):
+        # hit and miss counts of the compiled circuits cache
+        return {
+            "hits": self.cache_hits,
+            "misses": self.cache_misses,
+            "size": len(self.compiled_circuits)
+        }
+
     def simulate(self, backend=None):
         # Simulates the provided circuit
         if not backend:
             # define the backend if no backend is given
             backend = Aer.get_backend('statevector_simulator')
         
-        # transpile the circuit to the appropriate backend and run it n_sim times
-        self.circuit = transpile(self.circuit, backend)
-        results = backend.run(self.circuit, shots=self.n_sim)
+        # run the circuit transpiled for the backend n_sim times
+        compiled_circuit = self.compile(backend)
+        with instrumentation.span("simulate.run"):
+            counts = backend.run(compiled_circuit, shots=self.n_sim, seed_simulator=self.seed).result().get_counts()
         
-        return {key: probability/self.n_sim for key, probability in results.result().get_counts().items()}
-        
\ No newline at end of file
+        return {key: probability/self.n_sim for key, probability in counts.items()}
+
+    def submit_runs(self, backend, n_runs, executor=None):
+        # Submits a single job running the circuit n_runs times with n_sim shots each, without waiting for it.
+        # Aer runs its jobs one at a time unless they are given an executor of their own
+        options = {"executor": executor} if executor else {}
+        return backend.run(self.compile(backend), shots=n_runs*self.n_sim, memory=True, seed_simulator=self.seed, **options)
+
+    def collect_counts(self, job, n_runs):
+        # Waits for a job of submit_runs, returns a (n_runs x 2^width) matrix with the counts of every state in every run
+        with instrumentation.span("simulate.run"):
+            memory = job.result().get_memory()
+        return self.get_run_counts(memory, n_runs)
+
+    def get_run_counts(self, memory, n_runs):
+        # split the per-shot outcomes in consecutive runs of n_sim shots
+        n_states = 1 << self.circuit.num_clbits
+        outcomes = np.array([int(bits, 2) for bits in memory]).reshape(n_runs, self.n_sim)
+        outcomes += np.arange(n_runs)[:, np.newaxis] * n_states
+        return np.bincount(outcomes.ravel(), minlength=n_runs*n_states).reshape(n_runs, n_states)
+
+    def collect_observed_counts(self, job, n_runs):
+        # Sparse collect_counts for wide circuits, only the states observed in at least one shot are kept.
+        # Returns the sorted observed states (integer encoded) and a (n_runs x observed states) counts matrix
+        with instrumentation.span("simulate.run"):
+            memory = job.result().get_memory()
+
+        outcomes = np.array([int(bits, 2) for bits in memory])
+        states, inverse = np.unique(outcomes, return_inverse=True)
+        inverse = inverse.reshape(n_runs, self.n_sim) + np.arange(n_runs)[:, np.newaxis] * len(states)
+        return states, np.bincount(inverse.ravel(), minlength=n_runs*len(states)).reshape(n_runs, len(states))
+
+    def simulate_counts(self, backend, n_runs):
+        # Simulates the circuit n_runs times with n_sim shots each, submitting a single job.
+        # Returns a (n_runs x 2^width) matrix with the counts of every state in every run
+        return self.collect_counts(self.submit_runs(backend, n_runs), n_runs)
+
+    def simulate_observed_counts(self, backend, n_runs):
+        # simulate_counts restricted to the observed states, returns them with their counts matrix
+        return self.collect_observed_counts(self.submit_runs(backend, n_runs), n_runs)
+
+
+def submit_directly(function):
+    # transpiles and submits in the calling thread, see simulate_entry for a single submitting thread
+    return function()
+
+def simulate_counts_together(simulators, backend, n_runs, seed=None, submit=submit_directly, executor=None):
+    # Simulates the circuits of the simulators n_runs times each in a single job, sharing its overhead (the noise
+    # model is serialized for every job). The first circuit is seeded with seed, aer derives the seeds of the
+    # others. Returns the (n_runs x 2^width) counts matrix of every circuit
+    options = {"executor": executor} if executor else {}
+    job = submit(lambda: backend.run(
+        [simulator.compile(backend) for simulator in simulators], shots=n_runs*simulators[0].n_sim, memory=True, seed_simulator=seed, **options
+    ))
+    with instrumentation.span("simulate.run"):
+        result = job.result()
+    return [simulator.get_run_counts(result.get_memory(i), n_runs) for i, simulator in enumerate(simulators)]
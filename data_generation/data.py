@@ -1,33 +1,108 @@
 # generates circuits used to train the model and saves them in a csv file
-import random
-from qiskit.providers.fake_provider import Fake5QV1
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import numpy as np
+from qiskit.providers.fake_provider import Fake5QV1, Fake20QV1
 from circuit import CircuitGenerator
 from state import generate_circuit_state
+from cache import SimulationCache
+from noise import NumpyNoisyBackend
+from writer import CheckpointedWriter, CsvSink, ColumnarSink
 
-def gen_data(csv_file_name, n_circ):
-    fake_backend = Fake5QV1()
-
-    with open(csv_file_name, mode="w") as generation_file:
-        # Write headers to file
-        generation_file.write("circuit_width,circuit_depth,u1,u2,u3,cx,hamming_weight,25_observed_state_prob,50_observed_state_prob,75_observed_state_prob,25_frc_state_error,50_frc_state_error,75_frc_state_error,25_frc_program_error,50_frc_program_error,75_frc_program_error,true_probability,state_name\n")
-        circuit_generator = CircuitGenerator()
-        
-        # simulation
-        for i in range(n_circ):
-            # define randomly width, depth and gates
-            circuit_width = random.randint(1, 5)
-            circuit_depth = random.randint(1, 5)
-            gates = circuit_generator.get_applicable_gates(num_qubits=circuit_width,depth=circuit_depth)
-
-            # define the circuits
-            fc_circuit = circuit_generator.get_fc_circuit(circuit_width, gates)
-            frc_circuit = circuit_generator.get_frc_circuit(circuit_width, gates)
-            
-            # run simulations
-            columns, ext = generate_circuit_state(fc_circuit, frc_circuit, circuit_width, circuit_depth, fake_backend)
+
+# backend, generator, simulation cache and circuit settings of the current process, created once per worker
+fake_backend = None
+circuit_generator = None
+simulation_cache = None
+max_width = 5
+sparse = False
+adaptive = None
+
+def get_fake_backend(max_width):
+    # the 5 qubits backend of the original data, a 20 qubits one for the wider circuits
+    if max_width > 20:
+        raise ValueError(f"circuits of {max_width} qubits do not fit in the fake backends, 20 qubits at most")
+    return Fake5QV1() if max_width <= 5 else Fake20QV1()
+
+def init_worker(cache_dir=None, circuit_max_width=5, sparse_states=False, adaptive_sampling=None, engine="aer"):
+    global fake_backend, circuit_generator, simulation_cache, max_width, sparse, adaptive
+    if engine not in ("aer", "numpy"):
+        raise ValueError(f"unknown simulation engine {engine}, aer or numpy")
+    fake_backend = get_fake_backend(circuit_max_width)
+    if engine == "numpy":
+        fake_backend = NumpyNoisyBackend(fake_backend)
+    circuit_generator = CircuitGenerator()
+    simulation_cache = SimulationCache(cache_dir) if cache_dir else None
+    max_width = circuit_max_width
+    sparse = sparse_states
+    adaptive = adaptive_sampling
+
+def get_circuit_seeds(n_circ, seed=None):
+    # derives an independent seed for every circuit, so a circuit only depends on its index
+    return [int(child.generate_state(1)[0]) for child in np.random.SeedSequence(seed).spawn(n_circ)]
+
+def sample_circuit(circuit_seed):
+    # samples the width, depth and gates of a circuit from its seed, returns them with its fc and frc circuits
+    # independent streams for the shape and the gates, with the same seed the gates would repeat the width draw
+    shape_sequence, gates_sequence = np.random.SeedSequence(circuit_seed).spawn(2)
+    rng = np.random.default_rng(shape_sequence)
+
+    # define randomly width, depth and gates
+    circuit_width = int(rng.integers(1, max_width + 1))
+    circuit_depth = int(rng.integers(1, 6))
+    gates = circuit_generator.get_applicable_gates(num_qubits=circuit_width, depth=circuit_depth, seed=int(gates_sequence.generate_state(1)[0]))
+
+    # define the circuits
+    fc_circuit = circuit_generator.get_compact_fc_circuit(circuit_width, gates)
+    frc_circuit = fc_circuit.get_frc()
+
+    return circuit_width, circuit_depth, fc_circuit, frc_circuit
+
+def gen_circuit(circuit_seed):
+    # generates and simulates a single circuit, returns its rows and extras
+    circuit_width, circuit_depth, fc_circuit, frc_circuit = sample_circuit(circuit_seed)
+
+    # run simulations
+    return generate_circuit_state(fc_circuit, frc_circuit, circuit_width, circuit_depth, fake_backend, seed=circuit_seed, cache=simulation_cache, sparse=sparse, adaptive=adaptive)
+
+def get_sinks(csv_file_name, dataset_name):
+    # rows are written to the csv and/or to the columnar dataset directory, returns the sinks and their manifest name
+    sinks = []
+    if csv_file_name:
+        sinks.append(CsvSink(csv_file_name))
+    if dataset_name:
+        sinks.append(ColumnarSink(dataset_name))
+    return sinks, (csv_file_name or dataset_name) + ".manifest"
+
+def gen_data(csv_file_name, n_circ, n_workers=1, seed=None, flush_every=100, resume=True, dataset_name=None, cache_dir=None, max_width=5, sparse=False, adaptive=None, engine="aer"):
+    # An interrupted run with the same outputs and n_circ resumes from its last checkpoint.
+    # Circuits are up to max_width qubits wide (20 at most), sparse keeps only the observed states and the
+    # ideal support of every circuit, the dense states of wide circuits do not fit in memory.
+    # adaptive is an AdaptiveSampling, the FC and FRC runs used by every circuit are recorded in the manifest.
+    # engine "numpy" simulates the noise of the fake backend as density matrices instead of aer, for circuits
+    # whose transpiled version is active on up to 10 qubits
+    sinks, manifest_name = get_sinks(csv_file_name, dataset_name)
+
+    entropy = None if seed is None else np.random.SeedSequence(seed).entropy
+    with CheckpointedWriter(sinks, manifest_name, entropy, n_circ, flush_every=flush_every, resume=resume) as writer:
+        circuit_seeds = get_circuit_seeds(n_circ, writer.entropy)[writer.completed:]
+
+        # simulation, circuits are spread across the workers and written in order.
+        # Workers are spawned, forking a process that already ran Aer can deadlock
+        if n_workers > 1:
+            executor = ProcessPoolExecutor(max_workers=n_workers, mp_context=multiprocessing.get_context("spawn"), initializer=init_worker, initargs=(cache_dir, max_width, sparse, adaptive, engine))
+            results = executor.map(gen_circuit, circuit_seeds, chunksize=max(1, len(circuit_seeds) // (4 * n_workers)))
+        else:
+            executor = None
+            init_worker(cache_dir, max_width, sparse, adaptive, engine)
+            results = map(gen_circuit, circuit_seeds)
+
+        for i, (circuit_seed, (columns, ext)) in enumerate(zip(circuit_seeds, results), start=writer.completed):
             print(ext)
-            for column in columns:
-                generation_file.write(",".join([str(token) for token in column]) + "\n")
+            writer.write_circuit(circuit_seed, columns, [ext["fc_runs"], ext["frc_runs"]] if adaptive else None)
 
             if i % 10 == 0:
                 print(str(i) + "-th circuit")
+
+        if executor:
+            executor.shutdown()
@@ -0,0 +1,84 @@
+# evaluation of Qraft against the baseline: every benchmark circuit is simulated once and its metrics are
+# stored in a results table, from which the error bar charts and the empirical cdfs are rendered. Large
+# evaluations keep only the aggregated metrics, evaluate_streaming runs a range of circuits in batches
+import sys
+import numpy as np
+import pandas as pd
+from qiskit.providers.fake_provider import Fake5QV1
+from circuit import CircuitGenerator
+from state import generate_circuit_state
+from prediction import load_model, predict_circuits
+from cache import SimulationCache
+from aggregation import MetricsAggregator
+
+results_file_name = "evaluation_results.csv"
+metrics = ["medians", "dse", "program_error"]
+# base and qraft value of every metric
+metric_columns = [f"{metric}_{label}" for metric in metrics for label in ["base", "qraft"]]
+
+
+def get_metrics(extras):
+    # median state error, dominant state error and program error of a circuit, in %
+    return {
+        "medians": float(np.median(list(extras["states_errors"].values()))) * 100,
+        "dse": extras["dominant_state_error"] * 100,
+        "program_error": extras["program_error"] * 100
+    }
+
+def evaluate(model, n_circuits=25, circuit_width=3, circuit_depth=4, backend=None, cache=None, start=0):
+    # Simulates the benchmark circuits start, ..., start + n_circuits - 1 (fixed by their seed) and predicts all
+    # their states in a single batch. Returns the results table, one row per circuit with the base and qraft
+    # value of every metric
+    backend = backend or Fake5QV1()
+    circuit_generator = CircuitGenerator()
+
+    circuits_columns = []
+    circuits_extras = []
+    for circuit_name in range(start, start + n_circuits):
+        gates = circuit_generator.get_applicable_gates(num_qubits=circuit_width, depth=circuit_depth, seed=circuit_name)
+        fc_circuit = circuit_generator.get_compact_fc_circuit(circuit_width, gates)
+        states, extras = generate_circuit_state(fc_circuit, fc_circuit.get_frc(), circuit_width, circuit_depth, backend, seed=circuit_name, cache=cache)
+        circuits_columns.append(states)
+        circuits_extras.append(extras)
+
+    qraft_extras = predict_circuits(model, circuits_columns, [extras["dominant_state"] for extras in circuits_extras])
+
+    rows = []
+    for circuit_name, (extras, qraft_extra) in enumerate(zip(circuits_extras, qraft_extras), start=start):
+        base, qraft = get_metrics(extras), get_metrics(qraft_extra)
+        row = {"names": f"Circuit {circuit_name}"}
+        for metric in metrics:
+            row[f"{metric}_base"] = base[metric]
+            row[f"{metric}_qraft"] = qraft[metric]
+        rows.append(row)
+
+    return pd.DataFrame(rows)
+
+def evaluate_streaming(model, n_circuits, circuit_width=3, circuit_depth=4, backend=None, cache=None, start=0, batch_size=100, aggregator=None):
+    # Evaluates the circuits batch by batch keeping only the aggregated metrics, in constant memory.
+    # Workers evaluating disjoint ranges of circuits save their aggregates to be merged
+    backend = backend or Fake5QV1()
+    aggregator = aggregator or MetricsAggregator(metric_columns)
+    for batch_start in range(start, start + n_circuits, batch_size):
+        n_batch = min(batch_size, start + n_circuits - batch_start)
+        aggregator.update(evaluate(model, n_batch, circuit_width, circuit_depth, backend, cache, start=batch_start))
+    return aggregator
+
+def get_results(model_name="qraft.pkl", results_name=results_file_name):
+    # Evaluates the model and saves its results table. Always evaluated, so the plots follow the current model,
+    # the simulation cache leaves only the predictions to compute on the next runs
+    results = evaluate(load_model(model_name), cache=SimulationCache("simulation_cache"))
+    results.to_csv(results_name, index=False)
+    return results
+
+
+if __name__ == "__main__":
+    # evaluates the model (qraft.pkl or the first argument), then renders every plot from the new table
+    from benchmarking_error import render_error_plots
+    from benchmarking_empirical_cdf import render_ecdf_plots
+
+    results = get_results(sys.argv[1] if len(sys.argv) > 1 else "qraft.pkl")
+    print(results)
+
+    render_error_plots(results.head(10))
+    render_ecdf_plots(results)
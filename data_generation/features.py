@@ -0,0 +1,106 @@
+# feature rows built straight from FC/FRC count matrices, without simulating. Used to featurize in bulk the
+# results of real devices or of other simulators, e.g.
+#   features, offsets = build_features(widths, depths, gates_counts, fc_counts, frc_counts)
+#   predictions = model.predict(features)
+import numpy as np
+from writer import columns_schema
+
+# the 16 features of the training rows, in order
+feature_names = [name for name, _ in columns_schema[:16]]
+gate_names = ["u1", "u2", "u3", "cx"]
+percentiles = [25, 50, 75]
+
+
+def get_run_counts(runs, circuit_width, sparse=False):
+    # Converts a list of {state name: count} histograms, one per run, to a (n_runs x states) counts matrix.
+    # Returns the integer encoded observed states with it when sparse, all the 2^width states otherwise
+    if not runs:
+        raise ValueError("at least one run is needed")
+    for run in runs:
+        for name in run:
+            if len(name) != circuit_width or name.strip("01"):
+                raise ValueError(f"invalid state {name!r}, states are {circuit_width} characters of 0 and 1")
+    if sparse:
+        states = np.array(sorted({int(name, 2) for run in runs for name in run}), dtype=np.int64)
+    else:
+        states = np.arange(1 << circuit_width)
+
+    counts = np.zeros((len(runs), len(states)))
+    for i, run in enumerate(runs):
+        columns = np.searchsorted(states, [int(name, 2) for name in run])
+        counts[i, columns] = list(run.values())
+    if np.any(counts.sum(axis=1) == 0):
+        raise ValueError("every run needs at least one shot")
+    return states, counts
+
+def get_gates_matrix(gates_counts):
+    # (n_circuits x 4) u1, u2, u3, cx counts from a matrix or from count_ops like dicts
+    if len(gates_counts) and isinstance(gates_counts[0], dict):
+        return np.array([[gates_count.get(name, 0) for name in gate_names] for gates_count in gates_counts])
+    return np.asarray(gates_counts).reshape(-1, len(gate_names))
+
+def get_hamming_weights(circuit_width):
+    # hamming weight of every state, indexed by its integer value
+    states = np.arange(1 << circuit_width)
+    return np.array([(states >> bit) & 1 for bit in range(circuit_width)]).sum(axis=0)
+
+def get_group_features(fc_counts, frc_counts):
+    # Percentile features of k circuits of the same width and number of runs, from (k x n_runs x 2^width) counts.
+    # Every run is normalized by its own number of shots. Returns the (k x 2^width x 9) per state features
+    fc_probablities = fc_counts / fc_counts.sum(axis=2, keepdims=True)
+    frc_probablities = frc_counts / frc_counts.sum(axis=2, keepdims=True)
+
+    # forward reverse circuit, ideally it always returns the all-zero state
+    frc_errors = frc_probablities.copy()
+    frc_errors[:, :, 0] = np.abs(frc_errors[:, :, 0] - 1)
+    frc_program_errors = frc_errors.sum(axis=2) / 2
+
+    n_states = fc_counts.shape[2]
+    run_prob_percentile = np.percentile(fc_probablities, percentiles, axis=1)
+    frc_error_percentile = np.percentile(frc_errors, percentiles, axis=1)
+    frc_program_error_percentile = np.percentile(frc_program_errors, percentiles, axis=1)
+    return np.concatenate([
+        run_prob_percentile.transpose(1, 2, 0),
+        frc_error_percentile.transpose(1, 2, 0),
+        np.broadcast_to(frc_program_error_percentile.T[:, np.newaxis, :], (len(fc_counts), n_states, len(percentiles)))
+    ], axis=2) * 100
+
+def build_features(circuit_widths, circuit_depths, gates_counts, fc_counts, frc_counts):
+    # Feature matrix of many circuits at once, the same features as the rows of generate_circuit_state.
+    # fc_counts and frc_counts hold a (n_runs x 2^width) counts matrix per circuit, the columns indexed by the
+    # integer value of the states. The rows of circuit i are offsets[i]:offsets[i + 1], one per state in order.
+    # Circuits are grouped by width and number of runs, every group is featurized with array operations only.
+    # Returns the (n_rows x 16) feature matrix and the offsets
+    circuit_widths = np.asarray(circuit_widths, dtype=int)
+    circuit_depths = np.asarray(circuit_depths, dtype=int)
+    gates_counts = get_gates_matrix(gates_counts)
+    if not len(circuit_widths) == len(circuit_depths) == len(gates_counts) == len(fc_counts) == len(frc_counts):
+        raise ValueError("one width, depth, gates count and FC/FRC counts matrix per circuit is needed")
+
+    offsets = np.concatenate([[0], np.cumsum(1 << circuit_widths)])
+    features = np.empty((offsets[-1], len(feature_names)))
+
+    # circuit columns, repeated for all the states of a circuit
+    n_states = np.diff(offsets)
+    features[:, 0] = np.repeat(circuit_widths, n_states)
+    features[:, 1] = np.repeat(circuit_depths, n_states)
+    features[:, 2:6] = np.repeat(gates_counts, n_states, axis=0)
+
+    groups = {}
+    for i, (circuit_width, circuit_fc_counts, circuit_frc_counts) in enumerate(zip(circuit_widths.tolist(), fc_counts, frc_counts)):
+        circuit_fc_counts, circuit_frc_counts = np.asarray(circuit_fc_counts), np.asarray(circuit_frc_counts)
+        if circuit_fc_counts.shape[1] != 1 << circuit_width or circuit_frc_counts.shape[1] != 1 << circuit_width:
+            raise ValueError(f"the counts of circuit {i} need 2^{circuit_width} columns")
+        groups.setdefault((circuit_width, len(circuit_fc_counts), len(circuit_frc_counts)), []).append(i)
+
+    for (circuit_width, _, _), indices in groups.items():
+        group_features = get_group_features(
+            np.stack([np.asarray(fc_counts[i], dtype=float) for i in indices]),
+            np.stack([np.asarray(frc_counts[i], dtype=float) for i in indices])
+        )
+        # rows of the group circuits in the feature matrix
+        rows = (offsets[indices][:, np.newaxis] + np.arange(1 << circuit_width)).ravel()
+        features[rows, 6] = np.tile(get_hamming_weights(circuit_width), len(indices))
+        features[rows, 7:] = group_features.reshape(-1, group_features.shape[2])
+
+    return features, offsets
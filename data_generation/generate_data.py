@@ -1,3 +1,6 @@
+import os
 from data import gen_data
 
-gen_data(csv_file_name="data1.csv", n_circ=200)
\ No newline at end of file
+# the guard is needed by the spawned generation workers
+if __name__ == "__main__":
+    gen_data(csv_file_name="data1.csv", n_circ=200, n_workers=os.cpu_count())
\ No newline at end of file
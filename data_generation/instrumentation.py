@@ -0,0 +1,141 @@
+# opt-in timing spans and counters for the hot paths of the data generation and the predictions.
+# Nothing is recorded until a sink is enabled, e.g.
+#   instrumentation.enable(instrumentation.AggregatorSink())
+# or, also for spawned workers, by setting QRAFT_TRACE to the path of a json lines file
+import cProfile
+import functools
+import json
+import os
+import time
+
+# active sink, None while the instrumentation is disabled
+sink = None
+
+
+class NullSpan:
+    # shared no-op span returned while disabled
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+null_span = NullSpan()
+
+
+class Span:
+    def __init__(self, name) -> None:
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if sink is not None:
+            sink.record_span(self.name, self.start, time.perf_counter() - self.start)
+        return False
+
+
+def span(name):
+    # times the with block under name
+    return null_span if sink is None else Span(name)
+
+def timed(name):
+    # decorator timing every call of the function under name
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if sink is None:
+                return function(*args, **kwargs)
+            with Span(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def count(name, value=1):
+    # increments the counter name
+    if sink is not None:
+        sink.record_count(name, value)
+
+def enable(new_sink):
+    global sink
+    disable()
+    sink = new_sink
+    sink.start()
+    return sink
+
+def disable():
+    global sink
+    if sink is not None:
+        sink.close()
+    sink = None
+
+
+class AggregatorSink:
+    # Keeps count, total, min and max duration of every span and the totals of the counters in memory
+    def __init__(self) -> None:
+        self.spans = {}
+        self.counters = {}
+
+    def start(self):
+        pass
+
+    def record_span(self, name, start, seconds):
+        stats = self.spans.setdefault(name, {"count": 0, "total": 0.0, "min": float("inf"), "max": 0.0})
+        stats["count"] += 1
+        stats["total"] += seconds
+        stats["min"] = min(stats["min"], seconds)
+        stats["max"] = max(stats["max"], seconds)
+
+    def record_count(self, name, value):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def summary(self):
+        return {
+            "spans": {name: dict(stats, mean=stats["total"] / stats["count"]) for name, stats in self.spans.items()},
+            "counters": dict(self.counters)
+        }
+
+    def close(self):
+        pass
+
+
+class JsonLinesSink:
+    # Appends one json line per span and per counter increment. Lines are written with a single
+    # append each, so several processes can share the file
+    def __init__(self, file_name) -> None:
+        self.file_name = file_name
+
+    def start(self):
+        self.trace_file = open(self.file_name, mode="a", buffering=1)
+        self.pid = os.getpid()
+
+    def record_span(self, name, start, seconds):
+        self.trace_file.write(json.dumps({"type": "span", "name": name, "start": start, "seconds": seconds, "pid": self.pid}) + "\n")
+
+    def record_count(self, name, value):
+        self.trace_file.write(json.dumps({"type": "counter", "name": name, "value": value, "pid": self.pid}) + "\n")
+
+    def close(self):
+        self.trace_file.close()
+
+
+class ProfileSink(AggregatorSink):
+    # Aggregates spans and counters like AggregatorSink and profiles everything between enable and
+    # disable with cProfile, the stats are dumped for pstats when the sink is closed
+    def __init__(self, file_name) -> None:
+        super().__init__()
+        self.file_name = file_name
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        self.profile.enable()
+
+    def close(self):
+        self.profile.disable()
+        self.profile.dump_stats(self.file_name)
+
+
+if os.environ.get("QRAFT_TRACE"):
+    enable(JsonLinesSink(os.environ["QRAFT_TRACE"]))
@@ -0,0 +1,214 @@
+# native noisy simulation of the transpiled circuits. The noise of a fake backend is rebuilt from its calibration
+# properties as in qiskit_aer's NoiseModel.from_backend: after every gate a depolarizing channel fitted to the
+# gate error followed by the T1/T2 thermal relaxation over the gate length, and a readout error on every
+# measured qubit. Circuits are evolved as numpy density matrices and the shots of all the runs drawn at once, e.g.
+#   simulator = CircuitSimulator(circuit, seed=0)
+#   counts = simulator.simulate_counts(NumpyNoisyBackend(Fake5QV1()), n_runs=100)
+import numpy as np
+from qiskit.circuit.exceptions import CircuitError
+from circuit import get_backend_name
+
+
+def get_relaxation_fidelity(relaxations):
+    # average gate fidelity of the tensor product of single qubit thermal relaxations (reset probability, coherence decay)
+    dim = 1 << len(relaxations)
+    superop_trace = np.prod([1 + (1 - reset) + 2 * decay for reset, decay in relaxations])
+    return (superop_trace / dim + 1) / (dim + 1)
+
+def get_depolarizing_parameter(error, n_qubits, relax_fidelity):
+    # Depolarizing parameter p that, composed with the relaxation, gives the gate error (1 - average gate fidelity).
+    # Truncated to the physical bounds, None when the relaxation already explains the error
+    dim = 1 << n_qubits
+    if error is None or error <= 1 - relax_fidelity:
+        return None
+    error = min(error, dim / (dim + 1))
+    parameter = dim * (error - (1 - relax_fidelity)) / (dim * relax_fidelity - 1)
+    return min(parameter, 4**n_qubits / (4**n_qubits - 1))
+
+
+class NoiseProperties:
+    # Per gate depolarizing parameters and thermal relaxations and per qubit readout assignment matrices
+    # extracted from the calibration properties of a backend. Times are in seconds
+    def __init__(self, properties) -> None:
+        self.readout = {}
+        for qubit in range(len(properties.qubits)):
+            p_meas1_prep0, p_meas0_prep1 = self.get_readout_probabilities(properties, qubit)
+            # P(measured j | prepared i)
+            self.readout[qubit] = np.array([[1 - p_meas1_prep0, p_meas1_prep0], [p_meas0_prep1, 1 - p_meas0_prep1]])
+
+        self.gates = {}
+        for gate in properties.gates:
+            qubits = tuple(gate.qubits)
+            parameters = {parameter.name: parameter.value for parameter in gate.parameters}
+            length = properties.gate_length(gate.gate, qubits) if "gate_length" in parameters else 0
+
+            relaxations = [self.get_relaxation(properties, qubit, length) for qubit in qubits] if length else []
+            relax_fidelity = get_relaxation_fidelity(relaxations) if relaxations else 1
+            depolarizing = get_depolarizing_parameter(parameters.get("gate_error"), len(qubits), relax_fidelity)
+            if depolarizing is not None or relaxations:
+                self.gates[(gate.gate, qubits)] = (depolarizing, relaxations)
+
+    @staticmethod
+    def get_readout_probabilities(properties, qubit):
+        # the asymmetric assignment errors when calibrated, the symmetric readout error otherwise
+        names = {parameter.name: parameter.value for parameter in properties.qubits[qubit]}
+        if "prob_meas1_prep0" in names and "prob_meas0_prep1" in names:
+            return names["prob_meas1_prep0"], names["prob_meas0_prep1"]
+        readout_error = names.get("readout_error", 0)
+        return readout_error, readout_error
+
+    @staticmethod
+    def get_relaxation(properties, qubit, length):
+        # reset probability and coherence decay of a qubit over length, T2 truncated to 2 T1
+        t1 = properties.t1(qubit)
+        t2 = min(properties.t2(qubit), 2 * t1)
+        return 1 - np.exp(-length / t1), np.exp(-length / t2)
+
+
+class DensityMatrix:
+    # Density matrix of n qubits as a (2,)*2n tensor, qubit k being row axis n-1-k and column axis 2n-1-k
+    def __init__(self, n_qubits) -> None:
+        self.n_qubits = n_qubits
+        self.rho = np.zeros((2,) * 2 * n_qubits, dtype=complex)
+        self.rho[(0,) * 2 * n_qubits] = 1
+
+    def get_axes(self, qubits):
+        # row axes of the qubits, the most significant first as in the little-endian qiskit matrices
+        return [self.n_qubits - 1 - qubit for qubit in reversed(qubits)]
+
+    def apply_unitary(self, matrix, qubits):
+        n_operands = len(qubits)
+        unitary = matrix.reshape((2,) * 2 * n_operands)
+        inputs = list(range(n_operands, 2 * n_operands))
+        for axes, operator in [(self.get_axes(qubits), unitary), ([self.n_qubits + axis for axis in self.get_axes(qubits)], unitary.conj())]:
+            self.rho = np.moveaxis(np.tensordot(operator, self.rho, axes=(inputs, axes)), range(n_operands), axes)
+
+    def apply_depolarizing(self, parameter, qubits):
+        # (1 - p) rho + p I/d (x) Tr_qubits(rho)
+        axes = self.get_axes(qubits)
+        reduced = self.rho
+        for axis in sorted(axes, reverse=True):
+            reduced = np.trace(reduced, axis1=axis, axis2=axis + reduced.ndim // 2)
+
+        depolarized = (1 - parameter) * self.rho
+        index = [slice(None)] * 2 * self.n_qubits
+        for bits in np.ndindex(*(2,) * len(axes)):
+            for axis, bit in zip(axes, bits):
+                index[axis] = index[self.n_qubits + axis] = bit
+            depolarized[tuple(index)] += parameter * reduced / (1 << len(axes))
+        self.rho = depolarized
+
+    def apply_relaxation(self, reset, decay, qubit):
+        # amplitude damping towards |0> and dephasing of the coherences
+        axis = self.n_qubits - 1 - qubit
+        def index(row, column):
+            index = [slice(None)] * 2 * self.n_qubits
+            index[axis], index[self.n_qubits + axis] = row, column
+            return tuple(index)
+
+        self.rho[index(0, 0)] += reset * self.rho[index(1, 1)]
+        self.rho[index(1, 1)] *= 1 - reset
+        self.rho[index(0, 1)] *= decay
+        self.rho[index(1, 0)] *= decay
+
+    def get_probabilities(self):
+        # probabilities of the 2^n states, indexed by their integer value
+        dim = 1 << self.n_qubits
+        return np.clip(self.rho.reshape(dim, dim).diagonal().real, 0, None)
+
+
+class NumpyNoisyResult:
+    # the part of the qiskit Result used by CircuitSimulator
+    def __init__(self, memories) -> None:
+        self.memories = memories
+
+    def get_memory(self, experiment=0):
+        return self.memories[experiment]
+
+    def get_counts(self, experiment=0):
+        states, counts = np.unique(self.memories[experiment], return_counts=True)
+        return dict(zip(states.tolist(), counts.tolist()))
+
+
+class NumpyNoisyJob:
+    # already completed job, the circuits are simulated when submitted
+    def __init__(self, result) -> None:
+        self._result = result
+
+    def result(self):
+        return self._result
+
+
+class NumpyNoisyBackend:
+    # Drop-in replacement of a fake backend in CircuitSimulator. Circuits are still transpiled for the device, then
+    # simulated on the active qubits only as density matrices, without the per job overhead of aer
+    max_qubits = 10
+
+    def __init__(self, device) -> None:
+        self.device = device
+        self.noise = NoiseProperties(device.properties())
+
+    def name(self):
+        return get_backend_name(self.device) + "_numpy"
+
+    def properties(self):
+        return self.device.properties()
+
+    def configuration(self):
+        return self.device.configuration()
+
+    def get_probabilities(self, circuit):
+        # Exact probabilities of the outcomes of the transpiled circuit, indexed by the integer value of its classical bits
+        active_qubits = sorted({circuit.find_bit(qubit).index for instruction in circuit.data for qubit in instruction.qubits
+                                if instruction.operation.name != "barrier"})
+        if len(active_qubits) > self.max_qubits:
+            raise CircuitError(f"{len(active_qubits)} active qubits, the density matrices are limited to {self.max_qubits}")
+        local = {qubit: i for i, qubit in enumerate(active_qubits)}
+
+        state = DensityMatrix(len(active_qubits))
+        measured = {}
+        for instruction in circuit.data:
+            name = instruction.operation.name
+            qubits = tuple(circuit.find_bit(qubit).index for qubit in instruction.qubits)
+            if name == "barrier":
+                continue
+            if name == "measure":
+                measured[circuit.find_bit(instruction.clbits[0]).index] = qubits[0]
+                continue
+            if any(qubit in measured.values() for qubit in qubits):
+                raise CircuitError("only final measurements are supported")
+
+            local_qubits = [local[qubit] for qubit in qubits]
+            state.apply_unitary(instruction.operation.to_matrix(), local_qubits)
+            if (name, qubits) in self.noise.gates:
+                depolarizing, relaxations = self.noise.gates[(name, qubits)]
+                if depolarizing is not None:
+                    state.apply_depolarizing(depolarizing, local_qubits)
+                for local_qubit, (reset, decay) in zip(local_qubits, relaxations):
+                    state.apply_relaxation(reset, decay, local_qubit)
+
+        # marginal of the measured qubits, clbit c on axis (n_clbits - 1 - c), then the readout errors
+        n_qubits, n_clbits = len(active_qubits), circuit.num_clbits
+        probabilities = state.get_probabilities().reshape((2,) * n_qubits)
+        clbit_axes = [n_qubits - 1 - local[measured[clbit]] for clbit in reversed(range(n_clbits))]
+        other_axes = [axis for axis in range(n_qubits) if axis not in clbit_axes]
+        probabilities = np.transpose(probabilities, clbit_axes + other_axes).sum(axis=tuple(range(n_clbits, n_qubits)))
+        for clbit in range(n_clbits):
+            axis = n_clbits - 1 - clbit
+            assignment = self.noise.readout[measured[clbit]]
+            probabilities = np.moveaxis(np.tensordot(assignment.T, probabilities, axes=([1], [axis])), 0, axis)
+
+        probabilities = probabilities.ravel()
+        return probabilities / probabilities.sum()
+
+    def run(self, circuits, shots=1024, memory=True, seed_simulator=None, **options):
+        # Samples the shots of every circuit in a single draw, returns a completed job. Aer options such as
+        # executor are ignored
+        circuits = circuits if isinstance(circuits, list) else [circuits]
+        rng = np.random.default_rng(seed_simulator)
+        memories = []
+        for circuit in circuits:
+            probabilities = self.get_probabilities(circuit)
+            names = np.array([format(state, '0' + str(circuit.num_clbits) + 'b') for state in range(len(probabilities))])
+            memories.append(names[rng.choice(len(probabilities), size=shots, p=probabilities)].tolist())
+        return NumpyNoisyJob(NumpyNoisyResult(memories))
@@ -0,0 +1,106 @@
+# pipelined generation of the training data: circuit sampling, simulation and feature computation with
+# writing run as concurrent stages connected by bounded queues, so a slow stage applies backpressure to the
+# previous ones instead of stalling the whole generation. Same output as gen_data for the same seed
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import data
+from data import get_circuit_seeds, get_sinks, init_worker, sample_circuit
+from state import get_entry, get_statistics
+from writer import CheckpointedWriter
+
+
+async def run_stage(function, n_workers, input_queue, output_queue, n_next_workers):
+    # n_workers tasks apply function to the items of input_queue, then every next stage worker gets a None sentinel
+    async def worker():
+        while (item := await input_queue.get()) is not None:
+            await output_queue.put(await function(item))
+
+    await asyncio.gather(*[worker() for _ in range(n_workers)])
+    for _ in range(n_next_workers):
+        await output_queue.put(None)
+
+async def generate_pipelined(writer, circuit_seeds, start, generation_workers, simulation_workers, feature_workers, queue_size):
+    loop = asyncio.get_running_loop()
+    # aer and numpy release the GIL, so the blocking calls of the stages overlap on threads
+    executor = ThreadPoolExecutor(max_workers=generation_workers + 2 * simulation_workers + feature_workers + 1)
+    # the transpiler and the lazy simulator set up of the fake backends are not thread safe, circuits are
+    # transpiled and submitted by a single thread while aer runs the submitted jobs in the background
+    submit_executor = ThreadPoolExecutor(max_workers=1)
+    jobs_executor = ThreadPoolExecutor(max_workers=simulation_workers)
+    backend = data.fake_backend
+    cache = data.simulation_cache
+    sparse = data.sparse
+    adaptive = data.adaptive
+
+    def submit(function):
+        return submit_executor.submit(function).result()
+
+    async def generate(item):
+        index, circuit_seed = item
+        return (index, circuit_seed) + await loop.run_in_executor(executor, sample_circuit, circuit_seed)
+
+    async def simulate(item):
+        index, circuit_seed, circuit_width, circuit_depth, fc_circuit, frc_circuit = item
+        entry = await loop.run_in_executor(executor, lambda: get_entry(
+            fc_circuit, frc_circuit, circuit_width, backend, seed=circuit_seed, cache=cache, sparse=sparse, adaptive=adaptive, submit=submit, executor=jobs_executor
+        ))
+        return index, circuit_seed, circuit_width, circuit_depth, fc_circuit, entry
+
+    def get_columns(item):
+        # the FC and FRC runs are recorded with the rows when they are adaptive, as in gen_data
+        index, circuit_seed, circuit_width, circuit_depth, fc_circuit, entry = item
+        columns = get_statistics(circuit_width, entry, sparse).get_columns(circuit_depth, fc_circuit.count_ops())
+        return index, circuit_seed, columns, [len(entry["fc_counts"]), len(entry["frc_counts"])] if adaptive else None
+
+    async def featurize(item):
+        return await loop.run_in_executor(executor, get_columns, item)
+
+    async def write(results_queue):
+        # circuits complete out of order, they are buffered until all the previous ones are written
+        pending = {}
+        next_index = start
+        while (item := await results_queue.get()) is not None:
+            index, *circuit = item
+            pending[index] = circuit
+            while next_index in pending:
+                await loop.run_in_executor(executor, writer.write_circuit, *pending.pop(next_index))
+                if next_index % 10 == 0:
+                    print(str(next_index) + "-th circuit")
+                next_index += 1
+
+    async def feed(seeds_queue):
+        for index, circuit_seed in enumerate(circuit_seeds, start=start):
+            await seeds_queue.put((index, circuit_seed))
+        for _ in range(generation_workers):
+            await seeds_queue.put(None)
+
+    seeds_queue, circuits_queue, simulations_queue, results_queue = [asyncio.Queue(maxsize=queue_size) for _ in range(4)]
+    try:
+        await asyncio.gather(
+            feed(seeds_queue),
+            run_stage(generate, generation_workers, seeds_queue, circuits_queue, simulation_workers),
+            run_stage(simulate, simulation_workers, circuits_queue, simulations_queue, feature_workers),
+            run_stage(featurize, feature_workers, simulations_queue, results_queue, 1),
+            write(results_queue)
+        )
+    finally:
+        submit_executor.shutdown()
+        jobs_executor.shutdown()
+        executor.shutdown()
+
+def gen_data_pipelined(csv_file_name, n_circ, seed=None, flush_every=100, resume=True, dataset_name=None, cache_dir=None, max_width=5, sparse=False, adaptive=None,
+                       engine="aer", generation_workers=1, simulation_workers=4, feature_workers=1, queue_size=16):
+    # gen_data running its stages concurrently in a single process, every stage with its own number of workers
+    sinks, manifest_name = get_sinks(csv_file_name, dataset_name)
+
+    init_worker(cache_dir, max_width, sparse, adaptive, engine)
+    entropy = None if seed is None else np.random.SeedSequence(seed).entropy
+    with CheckpointedWriter(sinks, manifest_name, entropy, n_circ, flush_every=flush_every, resume=resume) as writer:
+        circuit_seeds = get_circuit_seeds(n_circ, writer.entropy)[writer.completed:]
+        asyncio.run(generate_pipelined(writer, circuit_seeds, writer.completed, generation_workers, simulation_workers, feature_workers, queue_size))
+
+
+if __name__ == "__main__":
+    gen_data_pipelined(csv_file_name="data1.csv", n_circ=200, simulation_workers=os.cpu_count())
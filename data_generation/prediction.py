@@ -0,0 +1,64 @@
+# batched Qraft inference on the rows produced by generate_circuit_state
+import os
+import sys
+import numpy as np
+import instrumentation
+
+
+def load_model(model_name="qraft.pkl"):
+    # a directory is a flat arrays forest exported by qraft/forest.py, anything else a pickled sklearn model
+    if os.path.isdir(model_name):
+        sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "qraft"))
+        from forest import FlatForest
+        return FlatForest(model_name)
+    # imported here, the flat forests are loaded without joblib and sklearn
+    import joblib
+    return joblib.load(model_name)
+
+
+def get_corrected_distribution(predictions, names):
+    # predictions are probabilities in %, negative ones are clipped and the distribution normalized
+    probabilities = np.clip(predictions, 0, None)
+    total = probabilities.sum()
+    probabilities = probabilities/total if total > 0 else np.full(len(names), 1/len(names))
+    return dict(zip(names, probabilities.tolist()))
+
+
+def get_features(columns):
+    # splits the rows of a circuit in the feature matrix, the true probabilities (%) and the state names
+    features = np.array([column[:-2] for column in columns], dtype=float)
+    true_probablities = np.array([column[-2] for column in columns], dtype=float)
+    names = [column[-1] for column in columns]
+    return features, true_probablities, names
+
+@instrumentation.timed("predict_circuits")
+def predict_circuits(model, circuits_columns, dominant_states):
+    # Predicts all the states of all the circuits with a single model call.
+    # Returns, for every circuit, the corrected probabilities and the qraft error metrics
+    circuits = [get_features(columns) for columns in circuits_columns]
+    if not circuits:
+        return []
+
+    features = np.concatenate([circuit[0] for circuit in circuits])
+    true_probablities = np.concatenate([circuit[1] for circuit in circuits])
+    with instrumentation.span("predict"):
+        predictions = model.predict(features)
+    instrumentation.count("predicted_states", len(features))
+
+    # errors of all the states, then per circuit sums via the offsets of the circuits rows
+    states_errors = np.abs(predictions - true_probablities) / 100
+    offsets = np.cumsum([0] + [len(circuit[2]) for circuit in circuits])
+    program_errors = np.add.reduceat(states_errors, offsets[:-1]) / 2
+
+    results = []
+    for i, (_, _, names) in enumerate(circuits):
+        circuit_predictions = predictions[offsets[i]:offsets[i + 1]].tolist()
+        circuit_errors = states_errors[offsets[i]:offsets[i + 1]].tolist()
+        results.append({
+            "predictions": dict(zip(names, circuit_predictions)),
+            "states_errors": dict(zip(names, circuit_errors)),
+            "program_error": float(program_errors[i]),
+            "dominant_state_error": circuit_errors[names.index(dominant_states[i])]
+        })
+
+    return results
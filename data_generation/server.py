@@ -0,0 +1,286 @@
+# long-running Qraft correction service. The model is loaded once, the FC/FRC count histograms of the hardware
+# runs of a circuit are posted as json and the corrected distribution is returned. Concurrent requests are
+# micro-batched in a single predict call. Served over HTTP or, with --unix-socket, over HTTP on a Unix socket, e.g.
+#   python data_generation/server.py --model qraft.pkl --port 8000
+#   curl -X POST localhost:8000/correct -d @circuit.json
+import argparse
+import collections
+import http.client
+import json
+import os
+import queue
+import socket
+import socketserver
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+from state import SparseStateStatistics, StateStatistics
+from features import get_run_counts
+from prediction import get_corrected_distribution, load_model
+import instrumentation
+
+
+def get_circuit_features(circuit):
+    # Feature matrix and state names of a request circuit:
+    #   {"circuit_width": 3, "circuit_depth": 4, "gates_count": {"u1": 1, "u2": 0, "u3": 2, "cx": 3},
+    #    "fc_counts": [{"000": 60, "101": 40}, ...], "frc_counts": [{"000": 90, "001": 10}, ...], "sparse": false}
+    # with one histogram per run. The ideal distribution is unknown, only the features are computed
+    circuit_width = int(circuit["circuit_width"])
+    sparse = bool(circuit.get("sparse", False))
+    if not 1 <= circuit_width <= 20:
+        raise ValueError(f"unsupported circuit width {circuit_width}, 20 qubits at most")
+
+    # every run is normalized by its own number of shots
+    fc_states, fc_counts = get_run_counts(circuit["fc_counts"], circuit_width, sparse)
+    frc_states, frc_counts = get_run_counts(circuit["frc_counts"], circuit_width, sparse)
+    fc_run_probablities = fc_counts/fc_counts.sum(axis=1, keepdims=True)
+    frc_run_probablities = frc_counts/frc_counts.sum(axis=1, keepdims=True)
+
+    if sparse:
+        statistics = SparseStateStatistics(circuit_width, np.zeros(1 << circuit_width), fc_states, fc_run_probablities, frc_states, frc_run_probablities)
+    else:
+        statistics = StateStatistics(circuit_width, np.zeros(1 << circuit_width), fc_run_probablities, frc_run_probablities)
+    return statistics.get_features(int(circuit["circuit_depth"]), circuit.get("gates_count", {})), statistics.names.tolist()
+
+
+class LatencyMetrics:
+    # Count, mean and percentiles of the latencies of every stage over the last window requests,
+    # with the sizes of the predicted batches
+    percentiles = [50, 90, 99]
+
+    def __init__(self, window=10000) -> None:
+        self.window = window
+        self.latencies = {}
+        self.counts = collections.Counter()
+        self.batch_requests = collections.deque(maxlen=window)
+        self.batch_rows = collections.deque(maxlen=window)
+        self.lock = threading.Lock()
+
+    def record(self, stage, seconds):
+        with self.lock:
+            self.latencies.setdefault(stage, collections.deque(maxlen=self.window)).append(seconds)
+            self.counts[stage] += 1
+
+    def record_batch(self, n_requests, n_rows):
+        with self.lock:
+            self.batch_requests.append(n_requests)
+            self.batch_rows.append(n_rows)
+            self.counts["batches"] += 1
+
+    def count(self, name):
+        with self.lock:
+            self.counts[name] += 1
+
+    def summary(self):
+        # latencies in milliseconds
+        with self.lock:
+            stages = {}
+            for stage, latencies in self.latencies.items():
+                milliseconds = np.array(latencies) * 1000
+                stages[stage] = dict(
+                    {"count": self.counts[stage], "mean_ms": float(milliseconds.mean()), "max_ms": float(milliseconds.max())},
+                    **{f"p{percentile}_ms": float(value) for percentile, value in zip(self.percentiles, np.percentile(milliseconds, self.percentiles))}
+                )
+            return {
+                "latency": stages,
+                "batches": {
+                    "count": self.counts["batches"],
+                    "mean_requests": float(np.mean(self.batch_requests)) if self.batch_requests else 0.0,
+                    "mean_rows": float(np.mean(self.batch_rows)) if self.batch_rows else 0.0
+                },
+                "errors": self.counts["errors"]
+            }
+
+
+class MicroBatcher:
+    # Predicts the feature matrices of concurrent requests with a single model call. The first request of a
+    # batch waits at most max_wait seconds for the others, a batch is closed earlier when it reaches max_rows
+    def __init__(self, model, metrics, max_rows=65536, max_wait=0.005) -> None:
+        self.model = model
+        self.metrics = metrics
+        self.max_rows = max_rows
+        self.max_wait = max_wait
+        self.requests = queue.Queue()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def submit(self, features):
+        # returns a future of the predictions of the rows of features
+        future = Future()
+        self.requests.put((features, future, time.perf_counter()))
+        return future
+
+    def get_batch(self):
+        batch = [self.requests.get()]
+        if batch[0] is None:
+            return None
+        n_rows = len(batch[0][0])
+        deadline = time.perf_counter() + self.max_wait
+        while n_rows < self.max_rows:
+            try:
+                request = self.requests.get(timeout=max(deadline - time.perf_counter(), 0))
+            except queue.Empty:
+                break
+            if request is None:
+                # closing, the collected requests are still predicted
+                self.requests.put(None)
+                break
+            batch.append(request)
+            n_rows += len(request[0])
+        return batch
+
+    def run(self):
+        while (batch := self.get_batch()) is not None:
+            start = time.perf_counter()
+            for _, _, submitted in batch:
+                self.metrics.record("queue", start - submitted)
+
+            features = np.concatenate([request[0] for request in batch])
+            try:
+                with instrumentation.span("server.predict"):
+                    predictions = self.model.predict(features)
+            except Exception as error:
+                for _, future, _ in batch:
+                    future.set_exception(error)
+                continue
+            self.metrics.record("predict", time.perf_counter() - start)
+            self.metrics.record_batch(len(batch), len(features))
+
+            offsets = np.cumsum([0] + [len(request[0]) for request in batch])
+            for i, (_, future, _) in enumerate(batch):
+                future.set_result(predictions[offsets[i]:offsets[i + 1]])
+
+    def close(self):
+        self.requests.put(None)
+        self.thread.join()
+
+
+class CorrectionHandler(BaseHTTPRequestHandler):
+    # POST /correct with a circuit, GET /metrics and GET /health
+    protocol_version = "HTTP/1.1"
+
+    def send_json(self, status, content):
+        body = json.dumps(content).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/metrics":
+            self.send_json(200, self.server.metrics.summary())
+        elif self.path == "/health":
+            self.send_json(200, {"status": "ok"})
+        else:
+            self.send_json(404, {"error": f"unknown path {self.path}"})
+
+    def do_POST(self):
+        if self.path != "/correct":
+            self.send_json(404, {"error": f"unknown path {self.path}"})
+            return
+
+        start = time.perf_counter()
+        metrics = self.server.metrics
+        try:
+            circuit = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            features, names = get_circuit_features(circuit)
+            metrics.record("features", time.perf_counter() - start)
+            predictions = self.server.batcher.submit(features).result()
+        except (ValueError, KeyError, TypeError) as error:
+            metrics.count("errors")
+            self.send_json(400, {"error": f"{type(error).__name__}: {error}"})
+            return
+
+        latency = time.perf_counter() - start
+        metrics.record("total", latency)
+        self.send_json(200, {
+            "probabilities": get_corrected_distribution(predictions, names),
+            "predictions": dict(zip(names, predictions.tolist())),
+            "latency_ms": latency * 1000
+        })
+
+    def log_message(self, format, *args):
+        # requests are accounted in the metrics, access logs only when verbose
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def address_string(self):
+        # Unix socket clients have no address
+        return self.client_address[0] if self.client_address else "unix"
+
+
+class UnixCorrectionServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve(model_name="qraft.pkl", host="localhost", port=8000, unix_socket=None, max_rows=65536, max_wait=0.005, verbose=False):
+    # Loads the model and serves the corrections until interrupted
+    metrics = LatencyMetrics()
+    start = time.perf_counter()
+    model = load_model(model_name)
+    print(f"Model {model_name} loaded in {time.perf_counter() - start:.2f}s")
+
+    if unix_socket:
+        if os.path.exists(unix_socket):
+            os.remove(unix_socket)
+        server = UnixCorrectionServer(unix_socket, CorrectionHandler)
+        print(f"Serving on unix socket {unix_socket}")
+    else:
+        server = ThreadingHTTPServer((host, port), CorrectionHandler)
+        print(f"Serving on http://{host}:{server.server_port}")
+
+    server.metrics = metrics
+    server.batcher = MicroBatcher(model, metrics, max_rows=max_rows, max_wait=max_wait)
+    server.verbose = verbose
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.batcher.close()
+        if unix_socket:
+            os.remove(unix_socket)
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    # HTTP connection to a server listening on a Unix socket
+    def __init__(self, unix_socket, timeout=60) -> None:
+        super().__init__("localhost", timeout=timeout)
+        self.unix_socket = unix_socket
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.unix_socket)
+
+def correct(circuit, host="localhost", port=8000, unix_socket=None, timeout=60):
+    # client side, posts a circuit to the server and returns its response
+    connection = UnixHTTPConnection(unix_socket, timeout) if unix_socket else http.client.HTTPConnection(host, port, timeout=timeout)
+    try:
+        connection.request("POST", "/correct", body=json.dumps(circuit), headers={"Content-Type": "application/json"})
+        response = connection.getresponse()
+        content = json.loads(response.read())
+    finally:
+        connection.close()
+
+    if response.status != 200:
+        raise ValueError(content.get("error", f"correction failed with status {response.status}"))
+    return content
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Qraft correction server")
+    parser.add_argument("--model", default="qraft.pkl", help="pickled model or exported forest directory")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--unix-socket", help="serve on this Unix socket instead of TCP")
+    parser.add_argument("--max-batch-rows", type=int, default=65536)
+    parser.add_argument("--max-wait-ms", type=float, default=5.0, help="time a request waits for others to batch with")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    serve(args.model, args.host, args.port, args.unix_socket, args.max_batch_rows, args.max_wait_ms / 1000, args.verbose)
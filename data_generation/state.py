@@ -1,7 +1,9 @@
+from statistics import NormalDist
 import numpy as np
 import numpy as np
-from circuit import CircuitSimulator
+from circuit import CircuitSimulator, StatevectorSimulator, CompactCircuit, simulate_counts_together, submit_directly
 from qiskit_aer import Aer
+import instrumentation
 
 class State:
     def __init__(self, name):
@@ -75,95 +77,267 @@ class State:
         return {combination: State(combination) for combination in get_binary_combinations(circuit_width)}
         
 
+class StateStatistics:
+    # Columnar statistics of all the states of a circuit. Run matrices hold one row per run and
+    # one column per state, the column index being the integer value of the state name
+    percentiles = [25, 50, 75]
+
+    @instrumentation.timed("state_statistics")
+    def __init__(self, circuit_width, ideal_probablities, run_probablities, frc_run_probablities):
+        self.circuit_width = circuit_width
+        self.names = np.array([format(i, '0' + str(circuit_width) + 'b') for i in range(1 << circuit_width)])
+        self.hw = np.array([name.count("1") for name in self.names])
+
+        # forward circuit
+        self.ideal_probablities = ideal_probablities
+        self.ideal_total = ideal_probablities.sum()
+        self.run_prob_percentile = np.percentile(run_probablities, self.percentiles, axis=0)
+        self.errors = np.abs(run_probablities - ideal_probablities)
+        self.average_errors = self.errors.mean(axis=0)
+        self.program_errors = self.errors.sum(axis=1)/2
+
+        # forward reverse circuit, ideally it always returns the all-zero state
+        self.frc_ideal_probablities = np.zeros(1 << circuit_width)
+        self.frc_ideal_probablities[0] = 1
+        self.frc_errors = np.abs(frc_run_probablities - self.frc_ideal_probablities)
+        self.frc_error_percentile = np.percentile(self.frc_errors, self.percentiles, axis=0)
+        self.frc_program_errors = self.frc_errors.sum(axis=1)/2
+        self.frc_program_error_percentile = np.percentile(self.frc_program_errors, self.percentiles)
+
+        # the first state with the highest ideal probability
+        self.dominant_state = int(np.argmax(ideal_probablities))
+
+    @staticmethod
+    def get_probability_vector(probablities, circuit_width):
+        # converts a {state name: probability} dict in a vector indexed by the state value
+        vector = np.zeros(1 << circuit_width)
+        for state, probability in probablities.items():
+            vector[int(state, 2)] = probability
+        return vector
+
+    @instrumentation.timed("feature_building")
+    def get_columns(self, circuit_depth, gates_count):
+        # returns one training row per state
+        circuit_columns = [
+            self.circuit_width, circuit_depth, gates_count.get("u1", 0), gates_count.get("u2", 0), gates_count.get("u3", 0), gates_count.get("cx", 0)
+        ]
+        program_error_columns = (self.frc_program_error_percentile*100).tolist()
+        true_probablities = self.ideal_probablities/self.ideal_total*100
+
+        return [
+            circuit_columns + [hw] + run_prob_percentile + frc_error_percentile + program_error_columns + [true_probablity, name]
+            for hw, run_prob_percentile, frc_error_percentile, true_probablity, name in zip(
+                self.hw.tolist(), (self.run_prob_percentile.T*100).tolist(), (self.frc_error_percentile.T*100).tolist(), true_probablities.tolist(), self.names.tolist()
+            )
+        ]
+
+    def get_features(self, circuit_depth, gates_count):
+        # (n_states x 16) feature matrix of the rows of get_columns, without the true probabilities and the names
+        n_states = len(self.names)
+        circuit_columns = [
+            self.circuit_width, circuit_depth, gates_count.get("u1", 0), gates_count.get("u2", 0), gates_count.get("u3", 0), gates_count.get("cx", 0)
+        ]
+        return np.column_stack([
+            np.broadcast_to(circuit_columns, (n_states, len(circuit_columns))), self.hw, self.run_prob_percentile.T*100,
+            self.frc_error_percentile.T*100, np.broadcast_to(self.frc_program_error_percentile*100, (n_states, len(self.percentiles)))
+        ]).astype(float)
+
+    def get_extras(self):
+        names = self.names.tolist()
+        return {
+            "ideal_prob": dict(zip(names, self.ideal_probablities.tolist())),
+            "states_errors": dict(zip(names, self.average_errors.tolist())),
+            "program_error": float(self.program_errors.mean()),
+            "dominant_state_error": float(self.average_errors[self.dominant_state]),
+            "dominant_state": names[self.dominant_state]
+        }
+
+
+class SparseStateStatistics(StateStatistics):
+    # StateStatistics of the states that matter only: the states observed in the FC runs, the support of the
+    # ideal distribution and the requested ones. Run matrices hold one column per observed state, the
+    # unobserved states have zero run probabilities, so the 2^width states of wide circuits are never
+    # materialized. Rows and extras cover the selected states, features are the same as StateStatistics
+    support_tolerance = 1e-12
+
+    @instrumentation.timed("state_statistics")
+    def __init__(self, circuit_width, ideal_probablities, fc_states, run_probablities, frc_states, frc_run_probablities, states=None):
+        self.circuit_width = circuit_width
+        self.ideal_total = ideal_probablities.sum()
+        support = np.flatnonzero(ideal_probablities > self.support_tolerance)
+        self.states = np.union1d(np.union1d(fc_states, support), [] if states is None else states).astype(np.int64)
+        self.names = np.array([format(state, '0' + str(circuit_width) + 'b') for state in self.states.tolist()])
+        self.hw = np.array([name.count("1") for name in self.names])
+
+        # forward circuit, the run probabilities are scattered on the selected states
+        self.ideal_probablities = ideal_probablities[self.states]
+        selected_run_probablities = self.get_selected(fc_states, run_probablities)
+        self.run_prob_percentile = np.percentile(selected_run_probablities, self.percentiles, axis=0)
+        self.errors = np.abs(selected_run_probablities - self.ideal_probablities)
+        self.average_errors = self.errors.mean(axis=0)
+        # the ideal probability of the states under the tolerance, never observed, is an error too
+        self.program_errors = (self.errors.sum(axis=1) + self.ideal_total - self.ideal_probablities.sum())/2
+
+        # forward reverse circuit, ideally it always returns the all-zero state
+        self.frc_ideal_probablities = (self.states == 0).astype(float)
+        self.frc_errors = np.abs(self.get_selected(frc_states, frc_run_probablities) - self.frc_ideal_probablities)
+        self.frc_error_percentile = np.percentile(self.frc_errors, self.percentiles, axis=0)
+        # program errors over all the observed states, the all-zero one counting as error 1 when never observed
+        frc_errors = np.abs(frc_run_probablities - (frc_states == 0)).sum(axis=1)
+        self.frc_program_errors = (frc_errors + (0 not in frc_states))/2
+        self.frc_program_error_percentile = np.percentile(self.frc_program_errors, self.percentiles)
+
+        # the first state with the highest ideal probability, always in the support
+        self.dominant_state = int(np.searchsorted(self.states, np.argmax(ideal_probablities)))
+
+    def get_selected(self, observed_states, run_probablities):
+        # (n_runs x selected states) run matrix from the one of the observed states, the others being zero
+        selected_run_probablities = np.zeros((len(run_probablities), len(self.states)))
+        observed = np.isin(observed_states, self.states)
+        selected_run_probablities[:, np.searchsorted(self.states, observed_states[observed])] = run_probablities[:, observed]
+        return selected_run_probablities
+
+
 n_sim = 100
 
-def generate_circuit_state(fc_circuit, frc_circuit,  circuit_width, circuit_depth, backend):
-  # forward circuits
-  simulator = CircuitSimulator(fc_circuit)
-  circuit_states = State.generate_states(circuit_width)
-
-  # ideal backend simulation
-  ideal_probablities = simulator.simulate()
-  for prob in ideal_probablities:
-      circuit_states[prob].set_ideal_probablity(ideal_probablities[prob])
-
-  # simulation on fake backend
-  for i in range(n_sim):
-      results = simulator.simulate(backend)
-
-      # computing simulated fake probabilities
-      for state in circuit_states:
-          circuit_states[state].add_run_probability(results.get(state, 0))
-
-  # calculate the run probablity perc of fc_circuit
-  for state in circuit_states:
-      circuit_states[state].calculate_run_probability_percentile()
-
-  # forward reverse circuit
-  frc_simulator = CircuitSimulator(frc_circuit)
-  frc_circuit_states = State.generate_states(circuit_width)
-
-  # simulation on fake backend
-  for i in range(n_sim):
-      results = frc_simulator.simulate(backend)
-
-      # computing simulated fake probabilities
-      for state in frc_circuit_states:
-          frc_circuit_states[state].add_run_probability(results.get(state, 0))
-
-  # init the prob of 00000 to 1. all the other states are 0
-  frc_circuit_states["0"*circuit_width].set_ideal_probablity(1)
-
-  # computing error percs for forward reverse circuit states
-  for state in frc_circuit_states:
-      circuit_states[state].calculate_errors()
-      frc_circuit_states[state].calculate_errors()
-      frc_circuit_states[state].calculate_error_percentile()
-
-
-    # computing perc program error for forward reverse circuit
-  frc_program_error = []
-  fc_program_error = []
-  for i in range(n_sim):
-      # print(i)
-      frc_program_error.append(0)
-      fc_program_error.append(0)
-      for state in frc_circuit_states:
-          frc_program_error[i] += frc_circuit_states[state].errors[i]
-          fc_program_error[i] += circuit_states[state].errors[i]
-      frc_program_error[i] = frc_program_error[i]/2 
-      fc_program_error[i] = fc_program_error[i]/2 
-  
-  true_state_prob = sum([circuit_states[state].ideal_probablity for state in circuit_states])
-
-  gates_count = fc_circuit.count_ops()
-  
-
-  columns = []
-  extras = {
-    "ideal_prob": {},
-    "states_errors": {},
-    "program_error": sum(fc_program_error)/len(fc_program_error)
-  }
-
-  domainant_state = None
-  for state in frc_circuit_states:
-      column = [
-          circuit_width, circuit_depth,gates_count.get("u1", 0), gates_count.get("u2", 0), gates_count.get("u3", 0), gates_count.get("cx", 0), frc_circuit_states[state].hw, # meidan state prob
-          circuit_states[state].run_prob_percentile[25]*100, circuit_states[state].run_prob_percentile[50]*100, circuit_states[state].run_prob_percentile[75]*100,
-          frc_circuit_states[state].error_percentile[25]*100, frc_circuit_states[state].error_percentile[50]*100, frc_circuit_states[state].error_percentile[75]*100,
-          np.percentile(frc_program_error, 25)*100, np.percentile(frc_program_error, 50)*100, np.percentile(frc_program_error, 75)*100,  (circuit_states[state].ideal_probablity/true_state_prob)*100, state
-      ]
-      extras["ideal_prob"][state] = circuit_states[state].ideal_probablity
-      extras["states_errors"][state] = circuit_states[state].average_error
-      if not domainant_state:
-        domainant_state = circuit_states[state]
-      else:
-        domainant_state = circuit_states[state] if circuit_states[state].ideal_probablity > domainant_state.ideal_probablity else domainant_state
-
-      columns.append(column)
-
-  extras["dominant_state_error"] = domainant_state.average_error
-  extras["dominant_state"] = domainant_state.name
-  
-  return columns, extras
\ No newline at end of file
+
+class AdaptiveSampling:
+    # Simulates the FC and FRC circuits in growing increments of runs, each until the confidence intervals of all
+    # its percentile features are within +-tolerance (a probability, 0.03 = 3%), or up to max_runs runs. The
+    # intervals are distribution free, given by the order statistics of the runs around the rank of every percentile
+    percentiles = StateStatistics.percentiles
+
+    def __init__(self, tolerance=0.03, min_runs=20, growth=2, max_runs=n_sim, confidence=0.95) -> None:
+        self.tolerance = tolerance
+        self.min_runs = min_runs
+        self.growth = growth
+        self.max_runs = max_runs
+        self.confidence = confidence
+        self.z = NormalDist().inv_cdf((1 + confidence) / 2)
+
+    def get_settings(self):
+        # identifies the sampling in the cache keys
+        return {"tolerance": self.tolerance, "min_runs": self.min_runs, "growth": self.growth, "max_runs": self.max_runs, "confidence": self.confidence}
+
+    def get_intervals(self, samples):
+        # (percentiles x columns) lower and upper bounds of the percentiles of every column of the (n_runs x columns)
+        # samples. The rank of the q-th quantile among n runs is binomial(n, q), the bounds are the order
+        # statistics z standard deviations away from its mean
+        n_runs = len(samples)
+        quantiles = np.array(self.percentiles) / 100
+        spread = self.z * np.sqrt(n_runs * quantiles * (1 - quantiles))
+        lower = np.clip(np.floor(n_runs * quantiles - spread).astype(int), 0, n_runs - 1)
+        upper = np.clip(np.ceil(n_runs * quantiles + spread).astype(int), 0, n_runs - 1)
+        ordered = np.sort(samples, axis=0)
+        return ordered[lower], ordered[upper]
+
+    def is_converged(self, samples):
+        lower, upper = self.get_intervals(samples)
+        return bool(np.all((upper - lower) / 2 <= self.tolerance))
+
+    @staticmethod
+    def get_frc_samples(frc_run_probablities):
+        # per state errors and program error of every FRC run, the features whose percentiles are taken
+        frc_errors = frc_run_probablities.copy()
+        frc_errors[:, 0] = np.abs(frc_errors[:, 0] - 1)
+        return np.column_stack([frc_errors, frc_errors.sum(axis=1) / 2])
+
+    def simulate_counts(self, fc_simulator, frc_simulator, backend, seed=None, submit=submit_directly, executor=None):
+        # Returns the (n_runs x 2^width) FC and FRC counts, n_runs being the runs each circuit needed.
+        # Every increment simulates the circuits not converged yet in a single job seeded with seed + increment,
+        # submitted with submit and run on executor as in simulate_entry
+        simulators = [fc_simulator, frc_simulator]
+        get_samples = [lambda run_probablities: run_probablities, self.get_frc_samples]
+        counts = [[], []]
+        sampled = [0, 1]
+        n_runs = 0
+        while sampled and n_runs < self.max_runs:
+            runs = min(max(self.min_runs if not n_runs else int(n_runs * (self.growth - 1)), 1), self.max_runs - n_runs)
+            increment_counts = simulate_counts_together([simulators[i] for i in sampled], backend, runs, None if seed is None else seed + len(counts[0]) + len(counts[1]), submit, executor)
+            for i, circuit_counts in zip(sampled, increment_counts):
+                counts[i].append(circuit_counts)
+            n_runs += runs
+
+            sampled = [i for i in sampled if not self.is_converged(get_samples[i](np.concatenate(counts[i]) / fc_simulator.n_sim))]
+
+        fc_counts, frc_counts = np.concatenate(counts[0]), np.concatenate(counts[1])
+        instrumentation.count("adaptive_sampling.runs", len(fc_counts) + len(frc_counts))
+        return fc_counts, frc_counts
+
+
+def get_cache_key(cache, circuit_width, fc_gates, backend, exact_ideal=True, seed=None, sparse=False, adaptive=None):
+    # key of the simulation of a circuit, every setting changing the simulated runs is part of it
+    return cache.get_key(circuit_width, fc_gates, backend, CircuitSimulator.n_sim, n_sim, seed, exact_ideal, sparse, adaptive.get_settings() if adaptive else None)
+
+def simulate_entry(fc_circuit, frc_circuit, circuit_width, fc_gates, backend, exact_ideal=True, seed=None, sparse=False, adaptive=None, submit=submit_directly, executor=None):
+    # Ideal probabilities and FC and FRC counts of a circuit, in the layout of the cache entries: observed states
+    # too when sparse. submit runs the functions transpiling and submitting the jobs, as the transpiler and
+    # the lazy set up of the fake backends are not thread safe, and aer runs the jobs on executor when given one
+    # ideal probabilities, exact from the numpy statevector
+    if exact_ideal:
+        ideal_probablities = StatevectorSimulator(circuit_width).simulate(fc_gates)
+
+    # forward circuits
+    simulator = CircuitSimulator(fc_circuit, seed=seed)
+
+    # or sampled with n_sim shots on the ideal backend
+    if not exact_ideal:
+        ideal_probablities = StateStatistics.get_probability_vector(submit(simulator.simulate), circuit_width)
+
+    # simulation on fake backend, all the runs of a circuit in a single job, both jobs submitted before waiting for any
+    frc_simulator = CircuitSimulator(frc_circuit, seed=None if seed is None else seed + 1)
+    entry = {"ideal_probablities": ideal_probablities}
+    if adaptive:
+        entry["fc_counts"], entry["frc_counts"] = adaptive.simulate_counts(simulator, frc_simulator, backend, seed, submit, executor)
+    else:
+        simulators = [simulator, frc_simulator]
+        jobs = submit(lambda: [simulator.submit_runs(backend, n_sim, executor) for simulator in simulators])
+        if sparse:
+            (entry["fc_states"], entry["fc_counts"]), (entry["frc_states"], entry["frc_counts"]) = [
+                simulator.collect_observed_counts(job, n_sim) for simulator, job in zip(simulators, jobs)
+            ]
+        else:
+            entry["fc_counts"], entry["frc_counts"] = [simulator.collect_counts(job, n_sim) for simulator, job in zip(simulators, jobs)]
+    return entry
+
+def get_entry(fc_circuit, frc_circuit, circuit_width, backend, exact_ideal=True, seed=None, cache=None, sparse=False, adaptive=None, submit=submit_directly, executor=None):
+    # simulate_entry of the circuits, previously simulated circuits are loaded from the cache
+    if sparse and adaptive:
+        raise ValueError("the adaptive sampling needs the dense states")
+    if isinstance(fc_circuit, CompactCircuit):
+        fc_gates = fc_circuit.to_gates()
+    else:
+        fc_gates = StatevectorSimulator.get_circuit_gates(fc_circuit)
+
+    if not cache:
+        return simulate_entry(fc_circuit, frc_circuit, circuit_width, fc_gates, backend, exact_ideal, seed, sparse, adaptive, submit, executor)
+    key = get_cache_key(cache, circuit_width, fc_gates, backend, exact_ideal, seed, sparse, adaptive)
+    entry = cache.get(key)
+    if not entry:
+        entry = simulate_entry(fc_circuit, frc_circuit, circuit_width, fc_gates, backend, exact_ideal, seed, sparse, adaptive, submit, executor)
+        cache.put(key, **entry)
+    return entry
+
+def get_statistics(circuit_width, entry, sparse=False, states=None):
+    # percentiles, errors and program errors of all the states of an entry at once
+    fc_run_probablities, frc_run_probablities = entry["fc_counts"]/CircuitSimulator.n_sim, entry["frc_counts"]/CircuitSimulator.n_sim
+    if sparse:
+        return SparseStateStatistics(
+            circuit_width, entry["ideal_probablities"], entry["fc_states"], fc_run_probablities, entry["frc_states"], frc_run_probablities, states
+        )
+    return StateStatistics(circuit_width, entry["ideal_probablities"], fc_run_probablities, frc_run_probablities)
+
+
+@instrumentation.timed("generate_circuit_state")
+def generate_circuit_state(fc_circuit, frc_circuit,  circuit_width, circuit_depth, backend, exact_ideal=True, seed=None, cache=None, sparse=False, states=None, adaptive=None):
+  # circuits are either qiskit circuits or compact circuits, lowered to qiskit only when simulated.
+  # sparse keeps only the observed states of every run, rows are generated for the observed states, the ideal
+  # support and the requested states (integer encoded) only, as needed by wide circuits.
+  # adaptive is an AdaptiveSampling simulating the runs until their features converge instead of n_sim runs,
+  # the runs used are returned in the extras
+  entry = get_entry(fc_circuit, frc_circuit, circuit_width, backend, exact_ideal, seed, cache, sparse, adaptive)
+  statistics = get_statistics(circuit_width, entry, sparse, states)
+
+  extras = statistics.get_extras()
+  extras["fc_runs"], extras["frc_runs"] = len(entry["fc_counts"]), len(entry["frc_counts"])
+  return statistics.get_columns(circuit_depth, fc_circuit.count_ops()), extras
@@ -0,0 +1,238 @@
+# streaming writers for the generated training data
+import json
+import os
+import numpy as np
+
+# fixed schema of the training rows. Features are float32 since sklearn trees split on float32 anyway,
+# state_name is stored as the integer value of the bitstring and decoded with circuit_width
+columns_schema = [
+    ("circuit_width", "int8"),
+    ("circuit_depth", "int16"),
+    ("u1", "int32"),
+    ("u2", "int32"),
+    ("u3", "int32"),
+    ("cx", "int32"),
+    ("hamming_weight", "int8"),
+    ("25_observed_state_prob", "float32"),
+    ("50_observed_state_prob", "float32"),
+    ("75_observed_state_prob", "float32"),
+    ("25_frc_state_error", "float32"),
+    ("50_frc_state_error", "float32"),
+    ("75_frc_state_error", "float32"),
+    ("25_frc_program_error", "float32"),
+    ("50_frc_program_error", "float32"),
+    ("75_frc_program_error", "float32"),
+    ("true_probability", "float64"),
+    ("state_name", "uint32"),
+]
+
+csv_header = ",".join(name for name, _ in columns_schema) + "\n"
+
+
+class CsvSink:
+    # Text export of the rows, one line per state
+    def __init__(self, file_name) -> None:
+        self.file_name = file_name
+
+    def start(self):
+        with open(self.file_name, mode="w") as generation_file:
+            generation_file.write(csv_header)
+        self.generation_file = open(self.file_name, mode="a")
+        return {"offset": self.generation_file.tell()}
+
+    def restore(self, position):
+        # rows past the checkpoint belong to circuits that will be generated again
+        with open(self.file_name, mode="r+") as generation_file:
+            generation_file.truncate(position["offset"])
+        self.generation_file = open(self.file_name, mode="a")
+
+    def write(self, columns, circuit_rows):
+        self.generation_file.write("".join(",".join([str(token) for token in column]) + "\n" for column in columns))
+
+    def sync(self):
+        self.generation_file.flush()
+        os.fsync(self.generation_file.fileno())
+        return {"offset": self.generation_file.tell()}
+
+    def close(self):
+        self.generation_file.close()
+
+
+class ColumnarSink:
+    # Typed columnar dataset: a directory with one raw little-endian file per column and a
+    # schema.json with the dtypes and the number of rows, so readers can memory-map single columns.
+    # The number of rows of every circuit is kept in circuit_rows.bin, the circuits of sparse datasets do not
+    # always start from the all-zero state
+    circuit_rows_name = "circuit_rows.bin"
+    circuit_rows_dtype = np.dtype("<u4")
+
+    def __init__(self, dataset_name) -> None:
+        self.dataset_name = dataset_name
+        self.rows = 0
+        self.circuits = 0
+
+    def get_column_path(self, name):
+        return os.path.join(self.dataset_name, name + ".bin")
+
+    def start(self):
+        os.makedirs(self.dataset_name, exist_ok=True)
+        self.column_files = [open(self.get_column_path(name), mode="wb") for name, _ in columns_schema]
+        self.circuit_rows_file = open(os.path.join(self.dataset_name, self.circuit_rows_name), mode="wb")
+        self.write_schema()
+        return {"rows": 0, "circuits": 0}
+
+    def restore(self, position):
+        self.rows = position["rows"]
+        self.circuits = position["circuits"]
+        self.column_files = []
+        for name, dtype in columns_schema:
+            with open(self.get_column_path(name), mode="r+b") as column_file:
+                column_file.truncate(self.rows * np.dtype(dtype).itemsize)
+            self.column_files.append(open(self.get_column_path(name), mode="ab"))
+        circuit_rows_path = os.path.join(self.dataset_name, self.circuit_rows_name)
+        with open(circuit_rows_path, mode="r+b") as circuit_rows_file:
+            circuit_rows_file.truncate(self.circuits * self.circuit_rows_dtype.itemsize)
+        self.circuit_rows_file = open(circuit_rows_path, mode="ab")
+        self.write_schema()
+
+    def write(self, columns, circuit_rows):
+        self.circuit_rows_file.write(np.asarray(circuit_rows, dtype=self.circuit_rows_dtype).tobytes())
+        self.circuits += len(circuit_rows)
+        if not columns:
+            return
+
+        values = list(zip(*columns))
+        state_names = [int(state_name, 2) for state_name in values[-1]]
+        for column_file, (_, dtype), column in zip(self.column_files, columns_schema, values[:-1] + [state_names]):
+            column_file.write(np.asarray(column, dtype=np.dtype(dtype).newbyteorder("<")).tobytes())
+        self.rows += len(columns)
+
+    def write_schema(self):
+        schema = {"columns": [{"name": name, "dtype": np.dtype(dtype).newbyteorder("<").str} for name, dtype in columns_schema], "rows": self.rows, "circuits": self.circuits}
+        schema_path = os.path.join(self.dataset_name, "schema.json")
+        with open(schema_path + ".tmp", mode="w") as schema_file:
+            json.dump(schema, schema_file)
+        os.replace(schema_path + ".tmp", schema_path)
+
+    def sync(self):
+        for column_file in self.column_files + [self.circuit_rows_file]:
+            column_file.flush()
+            os.fsync(column_file.fileno())
+        self.write_schema()
+        return {"rows": self.rows, "circuits": self.circuits}
+
+    def close(self):
+        for column_file in self.column_files + [self.circuit_rows_file]:
+            column_file.close()
+
+
+class CheckpointedWriter:
+    # Writes the rows of the generated circuits to the sinks in batches of circuits.
+    # After every batch a checkpoint with the completed circuit indices, seeds and number of rows of every
+    # circuit is appended to a json lines manifest, so an interrupted generation resumes from it
+
+    def __init__(self, sinks, manifest_name, entropy, n_circ, flush_every=100, resume=True) -> None:
+        self.sinks = sinks
+        self.manifest_name = manifest_name
+        self.entropy = entropy
+        self.n_circ = n_circ
+        self.flush_every = flush_every
+
+        # circuits already written and rows waiting for the next checkpoint
+        self.completed = 0
+        self.pending_rows = []
+        self.pending_circuit_rows = []
+        self.pending_seeds = []
+        self.pending_runs = []
+
+        if resume and os.path.exists(self.manifest_name):
+            self.load_checkpoint()
+        else:
+            self.start()
+
+    def start(self):
+        # creates the sinks and the manifest from scratch
+        if self.entropy is None:
+            self.entropy = np.random.SeedSequence().entropy
+
+        positions = [sink.start() for sink in self.sinks]
+        with open(self.manifest_name, mode="w") as manifest_file:
+            manifest_file.write(json.dumps({"entropy": self.entropy, "n_circ": self.n_circ, "positions": positions}) + "\n")
+
+        self.manifest_file = open(self.manifest_name, mode="a")
+
+    def load_checkpoint(self):
+        # reads the last complete checkpoint and drops everything written after it
+        with open(self.manifest_name) as manifest_file:
+            lines = manifest_file.read().split("\n")
+
+        manifest = json.loads(lines[0])
+        if manifest["n_circ"] != self.n_circ or len(manifest["positions"]) != len(self.sinks) or (self.entropy is not None and manifest["entropy"] != self.entropy):
+            raise ValueError(f"{self.manifest_name} belongs to a different generation run, remove it to start over")
+        self.entropy = manifest["entropy"]
+
+        valid_lines = [lines[0]]
+        positions = manifest["positions"]
+        for line in lines[1:]:
+            try:
+                checkpoint = json.loads(line)
+            except json.JSONDecodeError:
+                # the run was interrupted while writing this checkpoint
+                break
+            valid_lines.append(line)
+            self.completed = checkpoint["stop"]
+            positions = checkpoint["positions"]
+
+        with open(self.manifest_name, mode="w") as manifest_file:
+            manifest_file.write("\n".join(valid_lines) + "\n")
+
+        for sink, position in zip(self.sinks, positions):
+            sink.restore(position)
+        self.manifest_file = open(self.manifest_name, mode="a")
+
+    def write_circuit(self, circuit_seed, columns, runs=None):
+        # buffers the rows of the next circuit, circuits must be written in index order.
+        # runs, the number of simulated runs of the circuit when it varies, is recorded in the checkpoint
+        self.pending_seeds.append(circuit_seed)
+        self.pending_rows.extend(columns)
+        self.pending_circuit_rows.append(len(columns))
+        self.pending_runs.append(runs)
+
+        if len(self.pending_seeds) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        # writes the pending rows, then records them in the manifest
+        if not self.pending_seeds:
+            return
+
+        positions = []
+        for sink in self.sinks:
+            sink.write(self.pending_rows, self.pending_circuit_rows)
+            positions.append(sink.sync())
+
+        start = self.completed
+        self.completed += len(self.pending_seeds)
+        checkpoint = {"start": start, "stop": self.completed, "seeds": self.pending_seeds, "circuit_rows": self.pending_circuit_rows, "positions": positions}
+        if any(runs is not None for runs in self.pending_runs):
+            checkpoint["runs"] = self.pending_runs
+        self.manifest_file.write(json.dumps(checkpoint) + "\n")
+        self.manifest_file.flush()
+        os.fsync(self.manifest_file.fileno())
+
+        self.pending_rows = []
+        self.pending_circuit_rows = []
+        self.pending_seeds = []
+        self.pending_runs = []
+
+    def close(self):
+        self.flush()
+        for sink in self.sinks:
+            sink.close()
+        self.manifest_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
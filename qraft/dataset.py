@@ -0,0 +1,149 @@
+# reader of the columnar datasets written by data_generation/writer.py
+import json
+import os
+import numpy as np
+import pandas as pd
+
+
+def load_schema(dataset_name):
+    with open(os.path.join(dataset_name, "schema.json")) as schema_file:
+        return json.load(schema_file)
+
+def load_columns(dataset_name, columns=None):
+    # Returns {column name: read-only memory-mapped array}, only the requested columns are opened
+    schema = load_schema(dataset_name)
+    dtypes = {column["name"]: np.dtype(column["dtype"]) for column in schema["columns"]}
+    rows = schema["rows"]
+
+    arrays = {}
+    for name in columns or dtypes:
+        path = os.path.join(dataset_name, name + ".bin")
+        arrays[name] = np.memmap(path, dtype=dtypes[name], mode="r", shape=(rows,)) if rows else np.empty(0, dtype=dtypes[name])
+    return arrays
+
+def get_state_names(circuit_widths, state_codes):
+    # decodes the integer state names back to bitstrings of the circuit width
+    return [format(int(code), "0" + str(int(width)) + "b") for width, code in zip(circuit_widths, state_codes)]
+
+def load_dataframe(dataset_name, columns=None):
+    # Loads the dataset in a DataFrame with the same columns as data.csv, state_name is categorical
+    arrays = load_columns(dataset_name, columns)
+    if "state_name" in arrays:
+        circuit_widths = arrays["circuit_width"] if "circuit_width" in arrays else load_columns(dataset_name, ["circuit_width"])["circuit_width"]
+        arrays["state_name"] = pd.Categorical(get_state_names(circuit_widths, arrays["state_name"]))
+    return pd.DataFrame(arrays)
+
+def export_csv(dataset_name, csv_file_name):
+    # exports the columnar dataset to a csv file with the data.csv header
+    load_dataframe(dataset_name).to_csv(csv_file_name, index=False)
+
+def load_xy(data_name):
+    # Loads features and labels from a columnar dataset directory or from a csv file
+    if os.path.isdir(data_name):
+        columns = [column["name"] for column in load_schema(data_name)["columns"] if column["name"] != "state_name"]
+        data = load_dataframe(data_name, columns=columns)
+    else:
+        data = pd.read_csv(data_name)
+
+    X = data.drop(["true_probability", "state_name"], axis=1, errors="ignore")
+    return X, data["true_probability"]
+
+def get_circuit_split(circuit_indices, test_size=0.15, seed=42):
+    # Deterministic test mask of the circuits: a splitmix64 hash of (seed, circuit index) mapped to [0, 1)
+    with np.errstate(over="ignore"):
+        z = np.asarray(circuit_indices, dtype=np.uint64) + np.uint64(seed) * np.uint64(0x9E3779B97F4A7C15)
+        z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        z = z ^ (z >> np.uint64(31))
+    return (z >> np.uint64(11)).astype(np.float64) / float(1 << 53) < test_size
+
+def load_circuit_offsets(data_name):
+    # Row offsets of the circuits, the rows of circuit i are offsets[i]:offsets[i + 1]. Recorded by the writer in
+    # circuit_rows.bin of a columnar dataset and in the manifest of a csv file, None for data written without them
+    if os.path.isdir(data_name):
+        circuit_rows_path = os.path.join(data_name, "circuit_rows.bin")
+        if not os.path.exists(circuit_rows_path):
+            return None
+        schema = load_schema(data_name)
+        circuit_rows = np.fromfile(circuit_rows_path, dtype="<u4")[:schema["circuits"]]
+        offsets = np.concatenate([[0], np.cumsum(circuit_rows, dtype=np.int64)])
+        if offsets[-1] != schema["rows"]:
+            raise ValueError(f"the circuit rows of {data_name} do not match its {schema['rows']} rows")
+        return offsets
+
+    manifest_name = data_name + ".manifest"
+    if not os.path.exists(manifest_name):
+        return None
+    circuit_rows = []
+    with open(manifest_name) as manifest_file:
+        for line in manifest_file.read().split("\n")[1:]:
+            try:
+                checkpoint = json.loads(line)
+            except json.JSONDecodeError:
+                # empty last line or interrupted checkpoint
+                break
+            if "circuit_rows" not in checkpoint:
+                return None
+            circuit_rows += checkpoint["circuit_rows"]
+    return np.concatenate([[0], np.cumsum(circuit_rows, dtype=np.int64)])
+
+def load_circuit_indices(data_name):
+    # circuit index of every row, from the recorded circuit offsets. Data written without them is dense, its
+    # circuits are found from their first row, the all-zero state
+    offsets = load_circuit_offsets(data_name)
+    if offsets is not None:
+        return np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+    if os.path.isdir(data_name):
+        states = np.asarray(load_columns(data_name, ["state_name"])["state_name"])
+    else:
+        states = np.array([int(state_name, 2) for state_name in pd.read_csv(data_name, usecols=["state_name"], dtype={"state_name": str})["state_name"]])
+    return np.cumsum(states == 0) - 1
+
+def load_xy_split(data_name, test_size=0.15, seed=42):
+    # load_xy split in train and test rows by circuit with get_circuit_split, the states of a circuit share most
+    # of their features and always fall in the same split. Returns X_train, X_test, y_train, y_test
+    X, y = load_xy(data_name)
+    circuit_indices = load_circuit_indices(data_name)
+    if len(circuit_indices) != len(y):
+        raise ValueError(f"the circuits of {data_name} cover {len(circuit_indices)} rows out of {len(y)}")
+    test = get_circuit_split(circuit_indices, test_size, seed)
+    return X[~test], X[test], y[~test], y[test]
+
+def iter_raw_chunks(data_name, chunk_size):
+    # yields (features, y, state codes) blocks from a columnar dataset directory or a csv file
+    if os.path.isdir(data_name):
+        names = [column["name"] for column in load_schema(data_name)["columns"]]
+        arrays = load_columns(data_name)
+        feature_names = [name for name in names if name not in ("true_probability", "state_name")]
+        for start in range(0, len(arrays["true_probability"]), chunk_size):
+            stop = start + chunk_size
+            features = np.column_stack([arrays[name][start:stop] for name in feature_names]).astype(np.float32)
+            yield features, np.asarray(arrays["true_probability"][start:stop], dtype=np.float64), np.asarray(arrays["state_name"][start:stop])
+    else:
+        for chunk in pd.read_csv(data_name, chunksize=chunk_size, dtype={"state_name": str}):
+            states = np.array([int(state_name, 2) for state_name in chunk["state_name"]])
+            y = chunk["true_probability"].to_numpy(dtype=np.float64)
+            yield chunk.drop(["true_probability", "state_name"], axis=1).to_numpy(dtype=np.float32), y, states
+
+def iter_chunks(data_name, chunk_size=100000, split=None, test_size=0.15, seed=42):
+    # Streams (float32 features, y) blocks of at most chunk_size rows. With split="train" or "test" only the rows
+    # of the circuits in that split are yielded, every state of a circuit always falls in the same split.
+    # Circuits are found from the recorded circuit offsets, or from their all-zero state in older dense data
+    offsets = load_circuit_offsets(data_name)
+    n_circuits = 0
+    row = 0
+    for features, y, states in iter_raw_chunks(data_name, chunk_size):
+        if offsets is not None:
+            circuit_indices = np.searchsorted(offsets, np.arange(row, row + len(y)), side="right") - 1
+        else:
+            circuit_indices = n_circuits - 1 + np.cumsum(states == 0)
+            n_circuits = int(circuit_indices[-1]) + 1 if len(circuit_indices) else n_circuits
+        row += len(y)
+
+        if split is not None:
+            test = get_circuit_split(circuit_indices, test_size, seed)
+            keep = test if split == "test" else ~test
+            features, y = features[keep], y[keep]
+
+        if len(y):
+            yield features, y
@@ -0,0 +1,68 @@
+# flat array export of the trained RandomForestRegressor and a pure numpy evaluator for it
+import os
+import sys
+import numpy as np
+
+# arrays of the flattened forest, every one is saved in its own .npy file so it can be memory-mapped
+forest_arrays = ["feature", "threshold", "children_left", "children_right", "value", "roots"]
+
+
+def export_forest(model, forest_name):
+    # Concatenates the nodes of all the trees in contiguous arrays, children indices are global
+    trees = [estimator.tree_ for estimator in model.estimators_]
+    offsets = np.cumsum([0] + [tree.node_count for tree in trees])
+
+    arrays = {
+        "feature": np.concatenate([tree.feature for tree in trees]).astype(np.int32),
+        "threshold": np.concatenate([tree.threshold for tree in trees]).astype(np.float64),
+        # leaves keep -1 as children
+        "children_left": np.concatenate([np.where(tree.children_left < 0, -1, tree.children_left + offset) for tree, offset in zip(trees, offsets)]).astype(np.int32),
+        "children_right": np.concatenate([np.where(tree.children_right < 0, -1, tree.children_right + offset) for tree, offset in zip(trees, offsets)]).astype(np.int32),
+        "value": np.concatenate([tree.value[:, 0, 0] for tree in trees]).astype(np.float64),
+        "roots": offsets[:-1].astype(np.int32),
+    }
+
+    os.makedirs(forest_name, exist_ok=True)
+    for name in forest_arrays:
+        np.save(os.path.join(forest_name, name + ".npy"), arrays[name])
+
+
+class FlatForest:
+    # Evaluates the exported forest on batches of samples, same outputs as RandomForestRegressor.predict
+    batch_size = 4096
+
+    def __init__(self, forest_name, mmap=True) -> None:
+        # memory-mapped arrays are shared through the page cache by all the processes loading them
+        for name in forest_arrays:
+            setattr(self, name, np.load(os.path.join(forest_name, name + ".npy"), mmap_mode="r" if mmap else None))
+        self.n_estimators = len(self.roots)
+
+    def predict(self, X):
+        # sklearn compares the float32 features with the float64 thresholds
+        X = np.asarray(X, dtype=np.float32).astype(np.float64)
+        predictions = np.empty(len(X))
+        for start in range(0, len(X), self.batch_size):
+            predictions[start:start + self.batch_size] = self.predict_batch(X[start:start + self.batch_size])
+        return predictions
+
+    def predict_batch(self, X):
+        # walks all the (sample, tree) pairs down one level per iteration, pairs reaching a leaf are dropped
+        nodes = np.broadcast_to(self.roots, (len(X), self.n_estimators)).ravel().copy()
+        samples = np.repeat(np.arange(len(X)), self.n_estimators)
+        pairs = np.arange(len(nodes))
+
+        while len(pairs):
+            current = nodes[pairs]
+            left = self.children_left[current]
+            internal = left >= 0
+            pairs, current, left = pairs[internal], current[internal], left[internal]
+
+            go_left = X[samples[pairs], self.feature[current]] <= self.threshold[current]
+            nodes[pairs] = np.where(go_left, left, self.children_right[current])
+
+        return self.value[nodes].reshape(len(X), self.n_estimators).sum(axis=1) / self.n_estimators
+
+if __name__ == "__main__":
+    # exports a pickled model: python forest.py qraft.pkl qraft_forest
+    import joblib
+    export_forest(joblib.load(sys.argv[1]), sys.argv[2])
@@ -0,0 +1,52 @@
+# incremental updates of the trained model with newly generated circuits
+import sys
+import joblib
+import numpy as np
+from sklearn.metrics import mean_squared_error
+from dataset import load_xy_split
+from forest import export_forest
+
+
+def update_model(model, X_new, y_new, n_new_trees=20, max_estimators=None):
+    # Adds n_new_trees trees fitted only on the new rows to the forest (warm start), then evicts
+    # the oldest trees so that at most max_estimators are kept.
+    # sklearn seeds the new trees with the draws of random_state after the first len(estimators_) ones, once
+    # the forest is capped every update would reuse the seeds of trees still in it. Every update gets its own
+    # random_state derived from the original one and an update counter kept on the model
+    base_random_state = getattr(model, "base_random_state_", model.random_state)
+    if isinstance(base_random_state, (int, np.integer)):
+        model.base_random_state_ = int(base_random_state)
+        model.n_updates_ = getattr(model, "n_updates_", 0) + 1
+        model.set_params(random_state=int(np.random.SeedSequence([model.base_random_state_, model.n_updates_]).generate_state(1)[0]))
+    model.set_params(warm_start=True, n_estimators=len(model.estimators_) + n_new_trees)
+    model.fit(X_new, y_new)
+
+    if max_estimators and len(model.estimators_) > max_estimators:
+        model.estimators_ = model.estimators_[-max_estimators:]
+    model.set_params(warm_start=False, n_estimators=len(model.estimators_))
+
+    return model
+
+def update(model_name, data_name, output_name, n_new_trees=20, max_estimators=None):
+    # Updates the saved model with the new data, 15% of the new circuits are held out to report the mse change
+    model = joblib.load(model_name)
+    X_train, X_test, y_train, y_test = load_xy_split(data_name)
+
+    mse_before = mean_squared_error(y_test, model.predict(X_test))
+    update_model(model, X_train, y_train, n_new_trees=n_new_trees, max_estimators=max_estimators)
+    mse_after = mean_squared_error(y_test, model.predict(X_test))
+
+    joblib.dump(model, output_name)
+    export_forest(model, output_name.rsplit(".", 1)[0] + "_forest")
+    print(f"Held-out Mean Squared Error: {mse_before} -> {mse_after} ({mse_after - mse_before:+}), {len(model.estimators_)} trees")
+
+    return mse_before, mse_after
+
+
+if __name__ == "__main__":
+    # python incremental.py qraft.pkl new_data.csv qraft_updated.pkl [n_new_trees] [max_estimators]
+    update(
+        sys.argv[1], sys.argv[2], sys.argv[3],
+        n_new_trees=int(sys.argv[4]) if len(sys.argv) > 4 else 20,
+        max_estimators=int(sys.argv[5]) if len(sys.argv) > 5 else None
+    )
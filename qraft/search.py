@@ -0,0 +1,95 @@
+# parallel bayesian hyperparameter search with successive halving on n_estimators and checkpoints
+import hashlib
+import json
+import os
+import numpy as np
+import joblib
+from joblib import Parallel, delayed
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.metrics import mean_squared_error
+from sklearn.model_selection import KFold
+
+# skopt 0.9 still uses the removed np.int alias
+np.int = int
+from skopt import Optimizer
+
+
+def fit_and_score(model, X, y, train, test):
+    # grows the (warm started) forest on the training fold and returns its mse on the test fold
+    model.fit(X[train], y[train])
+    return mean_squared_error(y[test], model.predict(X[test]))
+
+def successive_halving(candidates, X, y, folds, eta=2, n_rungs=3, n_jobs=-1, random_state=42):
+    # Cross validates the candidates with 1/eta^k of their trees, keeping the best 1/eta of them at every rung.
+    # Forests are warm started, so the survivors only fit the trees added by the next rung.
+    # Pruned candidates keep the score of the last rung they reached
+    models = {
+        (i, j): RandomForestRegressor(**candidate, warm_start=True, random_state=random_state)
+        for i, candidate in enumerate(candidates) for j in range(len(folds))
+    }
+    scores = [None] * len(candidates)
+    alive = list(range(len(candidates)))
+
+    # sklearn forests release the GIL while fitting, threads avoid copying the data and the models
+    with Parallel(n_jobs=n_jobs, prefer="threads") as parallel:
+        for rung in range(n_rungs - 1, -1, -1):
+            for i in alive:
+                n_estimators = max(1, round(candidates[i]["n_estimators"] / eta ** rung))
+                for j in range(len(folds)):
+                    models[(i, j)].set_params(n_estimators=n_estimators)
+
+            fold_scores = parallel(
+                delayed(fit_and_score)(models[(i, j)], X, y, *folds[j]) for i in alive for j in range(len(folds))
+            )
+            for k, i in enumerate(alive):
+                scores[i] = float(np.mean(fold_scores[k * len(folds):(k + 1) * len(folds)]))
+
+            if rung:
+                alive = sorted(alive, key=lambda i: scores[i])[:max(1, int(np.ceil(len(alive) / eta)))]
+
+    return scores
+
+def get_search_fingerprint(X, y, param_space, cv, n_points, random_state):
+    # identifies the data and the settings of a search, a checkpoint is only resumed by the same search
+    digest = hashlib.sha256()
+    for array in (X, y):
+        digest.update(np.ascontiguousarray(array).tobytes())
+    settings = {"param_space": param_space, "cv": cv, "n_points": n_points, "random_state": random_state}
+    return {"rows": len(X), "data": digest.hexdigest(), "settings": json.dumps(settings, sort_keys=True)}
+
+def halving_bayes_search(X, y, param_space, n_iter=50, cv=5, n_points=8, n_jobs=-1, checkpoint=None, random_state=42):
+    # Bayesian search asking n_points candidates at a time, every batch evaluated with successive halving.
+    # Evaluated candidates are saved in the checkpoint after every batch, an interrupted search resumes from it
+    # and the checkpoint is removed once the search completes. Returns the best parameters and their cross
+    # validation mse
+    X, y = np.asarray(X), np.asarray(y)
+    names = list(param_space)
+    optimizer = Optimizer([param_space[name] for name in names], random_state=random_state)
+    folds = list(KFold(n_splits=cv).split(X))
+
+    fingerprint = get_search_fingerprint(X, y, param_space, cv, n_points, random_state)
+    x_iters, y_iters = [], []
+    if checkpoint and os.path.exists(checkpoint):
+        saved = joblib.load(checkpoint)
+        if not isinstance(saved, dict) or saved.get("fingerprint") != fingerprint:
+            raise ValueError(f"{checkpoint} belongs to a search on different data or settings, remove it to start over")
+        x_iters, y_iters = saved["x_iters"], saved["y_iters"]
+        optimizer.tell(x_iters, y_iters)
+
+    while len(x_iters) < n_iter:
+        points = optimizer.ask(n_points=min(n_points, n_iter - len(x_iters)))
+        candidates = [dict(zip(names, point)) for point in points]
+        scores = successive_halving(candidates, X, y, folds, n_jobs=n_jobs, random_state=random_state)
+        optimizer.tell(points, scores)
+
+        x_iters += points
+        y_iters += scores
+        if checkpoint:
+            joblib.dump({"fingerprint": fingerprint, "x_iters": x_iters, "y_iters": y_iters}, checkpoint)
+        print(f"{len(x_iters)}/{n_iter} candidates, best mse: {min(y_iters)}")
+
+    if checkpoint and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+
+    best = int(np.argmin(y_iters))
+    return dict(zip(names, x_iters[best])), y_iters[best]
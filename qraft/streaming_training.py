@@ -0,0 +1,39 @@
+# out-of-core training: the forest grows chunk by chunk, never holding all the rows in memory
+import sys
+import joblib
+import numpy as np
+from sklearn.ensemble import RandomForestRegressor
+from dataset import iter_chunks
+from forest import export_forest
+from incremental import update_model
+
+
+def train_streaming(data_name, trees_per_chunk=10, chunk_size=100000, test_size=0.15, seed=42, **forest_params):
+    # Every chunk of training circuits adds trees_per_chunk trees fitted on it only. The test circuits
+    # are split by circuit and their mse is accumulated chunk by chunk as well
+    model = None
+    for X, y in iter_chunks(data_name, chunk_size=chunk_size, split="train", test_size=test_size, seed=seed):
+        if model is None:
+            model = RandomForestRegressor(n_estimators=trees_per_chunk, random_state=seed, **forest_params).fit(X, y)
+        else:
+            update_model(model, X, y, n_new_trees=trees_per_chunk)
+
+    squared_error, n_rows = 0.0, 0
+    for X, y in iter_chunks(data_name, chunk_size=chunk_size, split="test", test_size=test_size, seed=seed):
+        squared_error += float(np.sum((model.predict(X) - y) ** 2))
+        n_rows += len(y)
+
+    return model, squared_error / n_rows if n_rows else None
+
+
+if __name__ == "__main__":
+    # python streaming_training.py data qraft_streaming.pkl [model with the forest parameters, e.g. qraft.pkl]
+    forest_params = {}
+    if len(sys.argv) > 3:
+        params = joblib.load(sys.argv[3]).get_params()
+        forest_params = {name: params[name] for name in ["max_depth", "min_samples_split", "min_samples_leaf", "max_features"]}
+
+    model, mse = train_streaming(sys.argv[1], **forest_params)
+    joblib.dump(model, sys.argv[2])
+    export_forest(model, sys.argv[2].rsplit(".", 1)[0] + "_forest")
+    print(f"{len(model.estimators_)} trees, Mean Squared Error: {mse}")
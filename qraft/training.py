@@ -1,21 +1,11 @@
-import numpy as np
-import pandas as pd
+import os
 import joblib
 from sklearn.model_selection import train_test_split
 from sklearn.ensemble import RandomForestRegressor
 from sklearn.metrics import mean_squared_error
-from skopt import BayesSearchCV
-
-# load the data
-data = pd.read_csv('data.csv')
-
-# remove the y
-X = data.drop('true_probability', axis=1)
-X = X.drop('state_name', axis=1)
-y = data['true_probability']
-
-# split in training and testing data (15% to testing)
-X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.15, random_state=42)
+from dataset import load_xy
+from forest import export_forest
+from search import halving_bayes_search
 
 # parameters
 param_space = {
@@ -26,34 +16,52 @@ param_space = {
     'max_features': (0.1, 1.0)
 }
 
-# defining the model
-rf = RandomForestRegressor(random_state=42)
 
-# use bayesian optimization
-np.int = int
-opt = BayesSearchCV(
-    estimator=rf,
-    search_spaces=param_space,
-    n_iter=50, 
-    random_state=42,
-    cv=5,  
-    scoring='neg_mean_squared_error',  # scoring metric
-    return_train_score=False
-)
+def train(data_name=None, model_name='qraft1.pkl', forest_name='qraft1_forest', n_iter=50, checkpoint='search_checkpoint.pkl'):
+    # Searches the hyperparameters, fits the best model on the training split and saves it pickled and as a
+    # flat arrays forest. Returns the model and its test mse
+    # load the data, from the columnar dataset when available, and split features and y
+    if data_name is None:
+        data_name = 'data' if os.path.isdir('data') else 'data.csv'
+    X, y = load_xy(data_name)
+
+    # split in training and testing data (15% to testing)
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.15, random_state=42)
+
+    # use bayesian optimization, candidates and cv folds run in parallel on all the cores, clearly bad
+    # candidates are pruned with successive halving on n_estimators. The search resumes from its checkpoint
+    best_params, best_mse = halving_bayes_search(
+        X_train, y_train,
+        param_space=param_space,
+        n_iter=n_iter,
+        cv=5,
+        n_jobs=-1,
+        checkpoint=checkpoint,
+        random_state=42
+    )
+    print("Best parameters:", best_params, "cv mse:", best_mse)
+
+    # fitting the best model on the whole training set
+    best_estimator = RandomForestRegressor(**best_params, n_jobs=-1, random_state=42)
+    best_estimator.fit(X_train, y_train)
+
 
-# print(X_train, y_train)
+    # save the model and load it
+    joblib.dump(best_estimator, model_name)
+    best_model = joblib.load(model_name)
 
-# fitting
-opt.fit(X_train, y_train)
+    # flat arrays version of the model, used for fast loading and single circuit inference
+    if forest_name:
+        export_forest(best_model, forest_name)
 
+    # testing
+    y_pred = best_model.predict(X_test)
 
-# save the model and load it
-joblib.dump(opt.best_estimator_, 'qraft1.pkl')
-best_model = joblib.load('qraft1.pkl')
+    # computing mse
+    mse = mean_squared_error(y_test, y_pred)
+    print("Mean Squared Error:", mse)
+    return best_model, mse
 
-# testing
-y_pred = best_model.predict(X_test)
 
-# computing mse
-mse = mean_squared_error(y_test, y_pred)
-print("Mean Squared Error:", mse)
\ No newline at end of file
+if __name__ == "__main__":
+    train()